@@ -0,0 +1,67 @@
+import ast
+
+import vm
+from sim import Block, Contract, Simulation, Stop, Tx, load_class
+
+# Counts up to tx.value, the else branch runs unless it breaks at 7
+LOOP = """
+i = 0
+while i < tx.value:
+    i = i + 1
+    if i == 7:
+        break
+else:
+    contract.storage['finished'] = 1
+contract.storage['i'] = i
+"""
+
+
+class BackendsRun(Simulation):
+
+    def run_example(self, script, backend, **constants):
+        """Run the tests of the simulation in ``script`` on ``backend``,
+        return the outcome of each"""
+        cls = load_class(script, Simulation)
+        simulation = cls()
+        # A contract of its own, the class attribute is shared
+        simulation.contract = cls.contract.__class__(**constants)
+        simulation.contract.backend = backend
+        outcomes = []
+        for name in cls.discover_tests():
+            getattr(simulation, name)()
+            outcomes.append((name, simulation.stopped, dict(simulation.contract.storage._storage)))
+        return outcomes
+
+    def test_subcurrency_agrees(self):
+        python = self.run_example('examples/subcurrency.py', 'python', MYCREATOR='alice')
+        bytecode = self.run_example('examples/subcurrency.py', 'bytecode', MYCREATOR='alice')
+        assert python == bytecode, (python, bytecode)
+
+    def test_while_else(self):
+        program = vm.Compiler().compile(ast.parse(LOOP))
+        for value in (3, 10):
+            tx = Tx(sender='alice', value=value)
+            python, bytecode = Contract(), Contract()
+            exec LOOP in {'tx': tx, 'contract': python}
+            vm.run(program, tx, bytecode, Block(), {})
+            assert dict(python.storage._storage) == dict(bytecode.storage._storage), value
+        assert dict(bytecode.storage._storage) == {'i': 7}
+        assert dict(python.storage._storage) == {'i': 7}
+
+    def test_out_of_steps(self):
+        program = vm.Compiler().compile(ast.parse(LOOP))
+        tx = Tx(sender='alice', value=10)
+        vm.run(program, tx, Contract(), Block(), {}, steps=1000)
+        try:
+            vm.run(program, tx, Contract(), Block(), {}, steps=20)
+            assert False, "expected Stop"
+        except Stop as e:
+            assert str(e) == "Out of steps"
+
+        # Simulation.run reports it as the stop reason of the tx
+        contract = load_class('examples/subcurrency.py', Simulation).contract.__class__(MYCREATOR='alice')
+        contract.backend = 'bytecode'
+        contract.step_budget = 5
+        self.run(Tx(sender='alice', value=100), contract)
+        assert self.stopped == "Out of steps"
+        assert contract.storage['alice'] == 0
@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+import bundle
+from sim import Block, Contract, Simulation, Tx, depends, stop
+
+class Ledger(Contract):
+    """Credits the sender with the value of every tx above the fee"""
+
+    def run(self, tx, contract, block):
+        if tx.value < 10:
+            stop("Insufficient fee")
+        contract.storage[tx.sender] += tx.value - 10
+        block.contract_storage('totals')['count'] += 1
+        block.set_account_balance(tx.sender, block.account_balance(tx.sender) + 1)
+
+
+class BundleRun(Simulation):
+
+    contract = Ledger()
+
+    def __init__(self):
+        Simulation.__init__(self)
+        self.block = None
+
+    def test_fill(self):
+        self.block = Block()
+        for i in range(1000):
+            self.run(Tx(sender=i % 7, value=10 + i), self.contract, self.block)
+        assert self.block.contract_storage('totals')['count'] == 1000
+
+    def test_roundtrip(self):
+        fd, path = tempfile.mkstemp(suffix=".bundle")
+        os.close(fd)
+        try:
+            bundle.save(self, path)
+            restored = BundleRun()
+            bundle.restore(restored, path)
+
+            assert restored.completed == ['test_fill']
+            assert dict(restored.contract.storage._storage) == dict(self.contract.storage._storage)
+            assert dict(restored.block._balances) == dict(self.block._balances)
+            assert restored.block.contract_storage('totals')['count'] == 1000
+
+            # Both continue alike from the restored state
+            tx = Tx(sender=3, value=50)
+            self.run(tx, self.contract, self.block)
+            restored.run(tx, restored.contract, restored.block)
+            assert restored.contract.storage[3] == self.contract.storage[3]
+            assert restored.block.contract_storage('totals')['count'] == 1001
+
+            # Tests depending on a completed test start from the state kept after it
+            restored._restore(restored._prefix_state(('test_fill',), restored.snapshots))
+            assert restored.block.contract_storage('totals')['count'] == 1000
+
+            # Without that state the restored run refuses to guess it
+            restored.snapshots = {}
+            try:
+                restored._prefix_state(('test_fill',), restored.snapshots)
+                assert False, "expected RuntimeError"
+            except RuntimeError:
+                pass
+        finally:
+            os.remove(path)
+
+    @depends('test_fill')
+    def test_after_fill(self):
+        assert self.block.contract_storage('totals')['count'] == 1000
@@ -0,0 +1,52 @@
+import json
+import socket
+import threading
+
+from daemon import Handler, TCPSimulationServer
+from sim import Contract, Simulation, load_class
+
+
+class DaemonSessionRun(Simulation):
+    """A session of the simulation daemon over a localhost TCP socket"""
+
+    def request(self, fp, **request):
+        fp.write(json.dumps(request) + "\n")
+        fp.flush()
+        return json.loads(fp.readline())
+
+    def test_session(self):
+        server = TCPSimulationServer(('127.0.0.1', 0), Handler)
+        server.setup_simulation(lambda script: load_class(script, Contract))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        sock = socket.create_connection(server.server_address)
+        fp = sock.makefile('rw')
+        try:
+            response = self.request(fp, op='load', script='examples/subcurrency.py',
+                                    constants={'MYCREATOR': 'alice'})
+            assert response == {'ok': True, 'contract': 'SubCurrency'}, response
+
+            response = self.request(fp, op='tx', sender='alice', value=100, block={'timestamp': 5})
+            assert response['ok'] and response['stopped'] is False, response
+            assert sorted(response['storage']) == [[1000, 1], ['alice', 10 ** 18]], response
+
+            response = self.request(fp, op='tx', sender='alice', value=100, data=['bob', 1000])
+            assert dict(map(tuple, response['storage'])) == {'alice': 10 ** 18 - 1000, 'bob': 1000}
+
+            response = self.request(fp, op='tx', sender='bob', value=100, data=['carol', 2000])
+            assert response['stopped'] == 'Insufficient funds, bob has 1000 needs 2000', response
+            assert response['storage'] == []
+
+            # Only the public block fields can be set
+            response = self.request(fp, op='tx', sender='alice', value=100, block={'_balances': {}})
+            assert not response['ok'] and 'Unknown block field' in response['error'], response
+
+            response = self.request(fp, op='storage')
+            assert dict(map(tuple, response['storage']))['bob'] == 1000
+        finally:
+            fp.close()
+            sock.close()
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+from oracle import Driver, read_series
+from sim import Simulation, Tx, load_class
+
+
+class DatafeedDriverRun(Simulation):
+    """Hedging against the datafeed, with the price published by an oracle.Driver"""
+
+    ts_zero = 1392632520
+    expiry = ts_zero + 30 * 86400 + 1
+
+    def __init__(self):
+        Simulation.__init__(self)
+        self.feed = load_class('examples/datafeed.py', Simulation).contract
+        self.hedging = load_class('examples/hedging.py', Simulation).contract
+
+    def series(self):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, 'w') as fp:
+            fp.write("timestamp,value\n%d,2500\n%d,400\n" % (self.ts_zero, self.expiry))
+        try:
+            return list(read_series(path))
+        finally:
+            os.remove(path)
+
+    def test_read_series(self):
+        assert self.series() == [(self.ts_zero, 2500), (self.expiry, 400)]
+
+    def test_ether_drops(self):
+        driver = Driver(self)
+        driver.add_feed(self.feed, self.hedging.D, self.series(), self.hedging.I, 'alice')
+        # Both consumer txs share their timestamp with a feed update
+        driver.add_txs(self.hedging, [(self.ts_zero, Tx(sender='bob', value=1000 * 10 ** 18)),
+                                      (self.expiry, Tx(sender='bob', value=200))])
+
+        # The update at ts_zero runs first, the contract is created at 2500
+        assert driver.run(until=self.ts_zero) == 2
+        assert self.feed.storage['USD'] == 2500
+        assert self.hedging.storage[1001] == 2495000
+        assert self.hedging.txs == []
+        assert driver.block.number == 2
+
+        # The drop to 400 is seen by the tx at expiry
+        assert driver.run() == 2
+        assert self.feed.storage['USD'] == 400
+        assert self.hedging.txs == [('bob', 5000 * 10 ** 18, 0, 0)]
+        assert driver.block.number == 3
+        assert driver.block.timestamp == self.expiry
@@ -1,4 +1,4 @@
-from sim import Block, Contract, Simulation, Tx, mktx, stop
+from sim import Block, Contract, Simulation, Tx, depends, mktx, stop
 from random import random
 import inspect
 
@@ -148,9 +148,8 @@ class LockinEscrowRun(Simulation):
         self.run_tx(sender=CUSTOMER, value=self.paid + MIN_FEE)
         assert self.stopped == "Customer paid(part)"
 
+    @depends('test_merchant_allow')
     def test_customer_pay_too_little(self):
-        self.reset()
-        self.test_merchant_allow()
         self.paid = random()*0.9*self.total
         self.run_tx(sender=CUSTOMER, value=self.paid + MIN_FEE, data=[C_SATISFIED])
         assert self.stopped == "Customer didnt pay enough"
@@ -166,9 +165,8 @@ class LockinEscrowRun(Simulation):
         assert self.stopped == "Customer paid and happy"
         self.assert_reset()
 
+    @depends('test_merchant_allow')
     def test_customer_pay_and_happy(self):
-        self.reset()
-        self.test_merchant_allow()
         self.paid = self.total + 1
         self.run_tx(sender=CUSTOMER, value=self.paid + MIN_FEE, data=[C_SATISFIED])
         assert self.contract.txs[0][0] == MERCHANT
@@ -177,9 +175,8 @@ class LockinEscrowRun(Simulation):
         assert self.contract.txs[1][1] == self.incentive
         self.assert_happy()
 
+    @depends('test_merchant_allow')
     def test_customer_pay_part(self):
-        self.assert_reset()
-        self.test_merchant_allow()
         self.paid = self.total + 1
         self.run_tx(sender=CUSTOMER, value=self.paid + MIN_FEE)
         assert self.stopped == "Customer paid(part)"  # (all, actually)
@@ -194,8 +191,8 @@ class LockinEscrowRun(Simulation):
         assert self.contract.txs[1][1] == self.incentive
         self.assert_happy()
 
+    @depends('test_customer_pay_part')
     def test_refund(self):
-        self.test_customer_pay_part()
         self.run_tx(sender=MERCHANT, value=MIN_FEE, data=[C_REFUND])
         assert self.stopped == "Customer refunded"
         assert self.contract.txs[0][0] == CUSTOMER
@@ -1,4 +1,5 @@
-from sim import Contract, Simulation, Tx, stop
+from sim import Block, Contract, Simulation, Tx, stop
+from mempool import BlockBuilder, Mempool
 
 class Namecoin(Contract):
     """Namecoin contract example from https://github.com/ethereum/wiki/wiki/%5BEnglish%5D-White-Paper#wiki-identity-and-reputation-systems"""
@@ -30,3 +31,15 @@ class NamecoinRun(Simulation):
         self.run(tx, self.contract)
         assert self.stopped == 'Key already reserved'
         assert self.contract.storage['ethereum.bit'] == '54.200.236.204'
+
+    def test_congested_block(self):
+        mempool = Mempool()
+        for i in range(10):
+            mempool.add(Tx(sender='bob', value=200, fee=i, data=['name%d.bit' % i, i]))
+        mempool.add(Tx(sender='carol', value=200, fee=100, data=['carol.bit', 100]))
+
+        receipts = BlockBuilder(mempool, self, limit=4).build(self.contract, Block(number=2))
+        assert [r.tx.sender for r in receipts] == ['carol', 'bob', 'bob', 'bob']
+        assert [r.tx.nonce for r in receipts] == [0, 0, 1, 2]
+        assert len(mempool) == 7
+        assert self.contract.storage['carol.bit'] == 100
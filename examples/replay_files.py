@@ -0,0 +1,73 @@
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+
+from replay import parse_value, read_txs, replay
+from sim import Contract, Simulation, stop
+
+class Deposits(Contract):
+    """Adds the value of every tx to the sender, stores the data as given"""
+
+    def run(self, tx, contract, block):
+        if tx.value < 10:
+            stop("Insufficient fee")
+        contract.storage[tx.sender] += tx.value
+        contract.storage[tx.sender, 'data'] = tx.data
+
+
+JSONL = """{"sender": "alice", "value": 1000000000000000000, "data": ["bob", 5]}
+
+{"sender": "bob", "value": 1e18, "fee": 2, "data": [1.5]}
+{"sender": "carol", "value": 5}
+"""
+
+CSV = """sender,value,fee,data,data
+alice,100,1,inf,nan
+bob,2.5e1,,Infinity,
+carol,1,,,
+"""
+
+
+class ReplayRun(Simulation):
+
+    def setup(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fp:
+            fp.write(text)
+        return path
+
+    def test_parse_value(self):
+        assert parse_value("1e18") == 10 ** 18
+        assert parse_value("1.5") == Decimal("1.5")
+        # Non-finite numbers stay strings
+        assert parse_value("inf") == "inf"
+        assert parse_value("-Infinity") == "-Infinity"
+        assert parse_value("nan") == "nan"
+        assert parse_value("bob") == "bob"
+
+    def test_jsonl(self):
+        self.directory = tempfile.mkdtemp()
+        try:
+            txs = list(read_txs(self.setup("txs.jsonl", JSONL)))
+            assert [tx.value for tx in txs] == [10 ** 18, 10 ** 18, 5]
+            assert txs[1].fee == 2 and txs[1].data == [Decimal("1.5")]
+
+            contract = Deposits()
+            stops = replay(self, contract, iter(txs), chunk_size=2)
+            assert stops == {None: 2, "Insufficient fee": 1}
+            assert contract.storage['bob'] == 10 ** 18
+        finally:
+            shutil.rmtree(self.directory)
+
+    def test_csv(self):
+        self.directory = tempfile.mkdtemp()
+        try:
+            contract = Deposits()
+            stops = replay(self, contract, read_txs(self.setup("txs.csv", CSV)))
+            assert stops == {None: 2, "Insufficient fee": 1}
+            assert contract.storage['alice', 'data'] == ["inf", "nan"]
+            assert contract.storage['bob', 'data'] == ["Infinity"]
+            assert contract.storage['bob'] == 25
+        finally:
+            shutil.rmtree(self.directory)
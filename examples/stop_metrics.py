@@ -0,0 +1,60 @@
+from sim import Contract, Metrics, Simulation, Stop, Tx, load_class, metrics, stop
+
+class Threshold(Contract):
+    """Stops every tx below 100 with a message naming its value"""
+
+    def run(self, tx, contract, block):
+        if tx.value < 100:
+            stop("Value %d below 100" % tx.value)
+        if tx.value > 10 ** 6:
+            raise Stop("Value too large")
+        contract.storage[tx.sender] = tx.value
+
+
+class StopMetricsRun(Simulation):
+
+    def new_stops(self, before):
+        return dict((reason, count - before.get(reason, 0)) for reason, count in metrics.stops.items()
+                    if count != before.get(reason, 0))
+
+    def test_python_stop_site(self):
+        before = dict(metrics.stops)
+        contract = Threshold()
+        for value in range(10):
+            self.run(Tx(sender='alice', value=value), contract)
+        assert self.stopped == "Value 9 below 100"
+        stops = self.new_stops(before)
+        # Ten messages, one label: the line of the stop call
+        assert len(stops) == 1, stops
+        site, count = stops.items()[0]
+        assert site.startswith("stop_metrics.py:") and count == 10, stops
+
+        # A Stop raised directly is labelled by its message
+        self.run(Tx(sender='alice', value=10 ** 7), contract)
+        assert self.new_stops(before)["Value too large"] == 1
+
+    def test_cll_stop_site(self):
+        before = dict(metrics.stops)
+        contract = load_class('examples/subcurrency.py', Simulation).contract.__class__(MYCREATOR='alice')
+        self.run(Tx(sender='alice', value=100), contract)
+        for value in (2000, 3000):
+            self.run(Tx(sender='bob', value=100, data=['charlie', value]), contract)
+        assert self.stopped == "Insufficient funds, bob has 0 needs 3000"
+        assert self.new_stops(before) == {"subcurrency.cll:11": 2}
+        assert 'sim_stops_total{reason="subcurrency.cll:11"}' in metrics.prometheus()
+
+    def test_export(self):
+        m = Metrics()
+        m.stop("escrow.cll:3")
+        m.stop("escrow.cll:3")
+        m.stop('say "no"')
+        m.stop(True)
+        lines = m.prometheus().splitlines()
+        assert 'sim_stops_total{reason="escrow.cll:3"} 2' in lines
+        assert 'sim_stops_total{reason="say \\"no\\""} 1' in lines
+        assert 'sim_stops_total{reason=""} 1' in lines
+
+        for i in range(Metrics.MAX_REASONS):
+            m.stop("reason %d" % i)
+        assert len(m.stops) == Metrics.MAX_REASONS + 1
+        assert m.stops["other"] == 3
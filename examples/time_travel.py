@@ -0,0 +1,98 @@
+from history import Recorder, BLOCK, CONTRACT_STORAGE
+from sim import Block, Contract, Simulation, Tx, stop
+
+class Counter(Contract):
+    """Writes its own storage, a feed storage of the block and a balance"""
+
+    def run(self, tx, contract, block):
+        if tx.value < 10:
+            stop("Insufficient fee")
+        contract.storage['last'] = tx.value
+        contract.storage[tx.sender] += 1
+        block.contract_storage('feed')['x'] = tx.value
+        block.set_account_balance(tx.sender, block.account_balance(tx.sender) + tx.value)
+
+
+class TimeTravelRun(Simulation):
+
+    TXS = 250
+
+    def txs(self):
+        for i in range(self.TXS):
+            yield Tx(sender=['alice', 'bob', 'carol'][i % 3], value=i)
+
+    def replay(self, n, shared):
+        """Run the first ``n`` txs without a recorder, return the final state"""
+        contract, block = Counter(), Block()
+        for i, tx in enumerate(self.txs()):
+            if i == n:
+                break
+            if not shared:
+                block = Block(number=i)
+            self.run(tx, contract, block)
+        return contract, block
+
+    def record(self, shared):
+        self.recorder = Recorder(interval=100)
+        contract, block = Counter(), Block()
+        for i, tx in enumerate(self.txs()):
+            if not shared:
+                block = Block(number=i)
+            else:
+                block.number = i
+            self.run(tx, contract, block)
+        recorder, self.recorder = self.recorder, None
+        return recorder
+
+    def check_seek(self, shared):
+        recorder = self.record(shared)
+        for n in (0, 1, 99, 100, 150, 249):
+            contract, block = recorder.seek(n)
+            expected_contract, expected_block = self.replay(n, shared)
+            if not shared:
+                # The block of tx n itself is fresh before it runs
+                expected_block = Block(number=n)
+            else:
+                expected_block.number = n
+            assert dict(contract.storage._storage) == dict(expected_contract.storage._storage), n
+            assert dict(block._balances) == dict(expected_block._balances), n
+            assert block.contract_storage('feed')['x'] == expected_block.contract_storage('feed')['x'], n
+            assert block.number == expected_block.number, n
+        return recorder
+
+    def test_seek_shared_block(self):
+        recorder = self.check_seek(shared=True)
+        history = recorder.history(('feed', 'x'), target=CONTRACT_STORAGE)
+        assert history == [(i, i) for i in range(10, self.TXS)]
+        assert recorder.history('last') == history
+        assert len(recorder.checkpoints) == 3
+
+    def test_seek_block_per_tx(self):
+        recorder = self.check_seek(shared=False)
+        assert len(recorder.checkpoints) == 3
+
+    def test_detach(self):
+        self.recorder = Recorder(interval=100)
+        contract, block = Counter(), Block()
+        self.run(Tx(sender='alice', value=10), contract, block)
+        recorder, self.recorder = self.recorder, None
+        logged = len(recorder.keys)
+        # Replaced recorders no longer see the writes
+        self.run(Tx(sender='alice', value=20), contract, block)
+        assert len(recorder.keys) == logged
+        assert 'on_write' not in contract.storage.__dict__
+        assert 'on_balance' not in block.__dict__
+
+    def test_pristine_blocks(self):
+        self.recorder = Recorder(interval=100)
+        contract = Counter()
+        for i in range(10):
+            self.run(Tx(sender='alice', value=10 + i), contract)
+        recorder, self.recorder = self.recorder, None
+        # Fresh blocks alike to the previous one log no copy of them
+        switches = [value for target, value in zip(recorder.targets, recorder.values)
+                    if target == BLOCK]
+        assert switches == [None] * 9
+        contract, block = recorder.seek(5)
+        assert contract.storage['last'] == 14
+        assert dict(block._balances) == {}
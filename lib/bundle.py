@@ -0,0 +1,95 @@
+"""Save and restore the state of a ``Simulation`` as a binary bundle.
+
+A bundle holds the pickled simulation state, i.e. its contracts with their
+constants and translated ``.cll`` closures and its blocks with balances, the
+names of the tests already run and the states kept for tests depending on
+them, followed by the contents of every ``Storage`` as a separate marshalled blob:
+
+    magic | root offset, root length | storage blobs... | root pickle
+
+Restoring memory-maps the file and only unpickles the root. Storages are
+decoded from the map when they are first accessed.
+"""
+from collections import defaultdict
+import cPickle as pickle
+from cStringIO import StringIO
+import marshal
+import mmap
+import struct
+
+from sim import Storage
+
+MAGIC = "SIMBNDL3"
+HEADER = struct.Struct("<8sQQ")
+BLOB = struct.Struct("<cQ")
+
+
+def _encode(fp, storage):
+    contents = dict(storage._storage)
+    try:
+        kind, data = 'm', marshal.dumps(contents)
+    except ValueError:
+        kind, data = 'p', pickle.dumps(contents, pickle.HIGHEST_PROTOCOL)
+    offset = fp.tell()
+    fp.write(BLOB.pack(kind, len(data)))
+    fp.write(data)
+    return offset
+
+
+def _decoder(buf, offset):
+    def load():
+        kind, length = BLOB.unpack_from(buf, offset)
+        start = offset + BLOB.size
+        data = buf[start:start + length]
+        contents = marshal.loads(data) if kind == 'm' else pickle.loads(data)
+        return defaultdict(int, contents)
+    return load
+
+
+def save(simulation, path):
+    """Write the state of ``simulation`` to the bundle ``path``"""
+    with open(path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, 0, 0))
+
+        def persistent_id(obj):
+            if isinstance(obj, Storage):
+                return _encode(fp, obj)
+            return None
+
+        root = StringIO()
+        pickler = pickle.Pickler(root, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump((simulation.state(), simulation.completed, simulation.snapshots))
+
+        offset = fp.tell()
+        fp.write(root.getvalue())
+        fp.seek(0)
+        fp.write(HEADER.pack(MAGIC, offset, len(root.getvalue())))
+
+
+def restore(simulation, path):
+    """Restore the state saved in the bundle ``path`` into ``simulation``.
+
+    The tests run before saving count as completed, so ``run_all`` continues
+    with the remaining ones, starting those depending on completed tests from
+    the state kept after them.
+    """
+    with open(path, 'rb') as fp:
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, offset, length = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a simulation bundle" % path)
+
+    def persistent_load(blob_offset):
+        storage = Storage.__new__(Storage)
+        storage._load = _decoder(buf, blob_offset)
+        return storage
+
+    unpickler = pickle.Unpickler(StringIO(buf[offset:offset + length]))
+    unpickler.persistent_load = persistent_load
+    state, completed, snapshots = unpickler.load()
+    for name, value in state.items():
+        setattr(simulation, name, value)
+    simulation.completed = list(completed)
+    simulation.snapshots = snapshots
@@ -0,0 +1,142 @@
+"""Content-addressed cache of simulation results, and an index of tests.
+
+An entry is found by the hash of the simulation script, the simulator core
+and the run options. It records the ``.cll`` sources and the files of the
+Python modules the run loaded with their hashes, and is only used while those
+still match:
+
+    <dir>/<key>.json = {"sources": {path: sha1}, "ok": bool, "detail": str, "seconds": float}
+
+The ``DiscoveryIndex`` in ``<dir>/discovery.idx`` maps every simulation
+script to its ``Simulation`` class and ordered test names, so they are not
+searched for again while the script is unchanged.
+"""
+import hashlib
+import imp
+import json
+import marshal
+import os
+import sys
+
+from sim import Simulation, load_class
+
+LIB = os.path.dirname(os.path.abspath(__file__))
+CORE = [os.path.join(LIB, 'sim.py'), os.path.join(LIB, 'vm.py')]
+DEFAULT_DIR = os.environ.get('SIM_CACHE_DIR', '.simcache')
+
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def module_files(names):
+    """Return the source files of the modules in ``sys.modules`` called ``names``"""
+    files = set()
+    for name in names:
+        path = getattr(sys.modules.get(name), '__file__', None)
+        if path is None:
+            continue
+        if path.endswith(('.pyc', '.pyo')) and os.path.exists(path[:-1]):
+            path = path[:-1]
+        files.add(path)
+    return files
+
+
+class ResultCache(object):
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+
+    def key(self, script, options=()):
+        h = hashlib.sha1()
+        for path in [script] + CORE:
+            h.update("%s\0%s\0" % (os.path.basename(path), file_hash(path)))
+        h.update(json.dumps(sorted(options)))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Return the entry of ``key`` if its sources are unchanged, else None"""
+        try:
+            with open(self._path(key)) as fp:
+                entry = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        for path, digest in entry['sources'].items():
+            if file_hash(path) != digest:
+                return None
+        return entry
+
+    def put(self, key, sources, ok, detail, seconds):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        entry = {'sources': dict((path, file_hash(path)) for path in sources),
+                 'ok': ok, 'detail': detail, 'seconds': seconds}
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, 'w') as fp:
+            json.dump(entry, fp)
+        os.rename(tmp, self._path(key))
+
+
+class DiscoveryIndex(object):
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.path = os.path.join(directory, 'discovery.idx')
+        # absolute script path -> (mtime, size, sha1, class name, test names)
+        try:
+            with open(self.path, 'rb') as fp:
+                self.entries = marshal.load(fp)
+        except (IOError, EOFError, ValueError, TypeError):
+            self.entries = {}
+        self.dirty = False
+
+    def lookup(self, script):
+        """Return the entry of ``script`` if the file did not change, else None"""
+        entry = self.entries.get(os.path.abspath(script))
+        if entry is None:
+            return None
+        st = os.stat(script)
+        if (st.st_mtime, st.st_size) == entry[:2]:
+            return entry
+        # Touched but possibly unchanged
+        if file_hash(script) == entry[2]:
+            entry = (st.st_mtime, st.st_size) + entry[2:]
+            self.entries[os.path.abspath(script)] = entry
+            self.dirty = True
+            return entry
+        return None
+
+    def load(self, script):
+        """Load ``script`` and return its ``Simulation`` class with ``tests`` set"""
+        entry = self.lookup(script)
+        if entry is not None:
+            module = imp.load_source(os.path.splitext(os.path.basename(script))[0], script)
+            cls = getattr(module, entry[3], None)
+            if cls is not None:
+                cls.tests = list(entry[4])
+                return cls
+
+        cls = load_class(script, Simulation)
+        st = os.stat(script)
+        self.entries[os.path.abspath(script)] = (st.st_mtime, st.st_size, file_hash(script),
+                                                 cls.__name__, cls.discover_tests())
+        self.dirty = True
+        return cls
+
+    def save(self):
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as fp:
+            marshal.dump(self.entries, fp)
+        os.rename(tmp, self.path)
+        self.dirty = False
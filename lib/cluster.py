@@ -0,0 +1,250 @@
+"""Coordinator and workers sharing simulation work over TCP.
+
+Workers connect to the coordinator and pull one work unit at a time, so fast
+workers take more of them. Once the queue is empty idle workers steal a copy
+of the oldest unit still running elsewhere, the first result wins. Units of a
+worker that disconnects are queued again, until ``MAX_ATTEMPTS`` workers got
+lost running them. Local workers that exit are started again, and once none
+can be started and no worker is connected the remaining units fail.
+Results are merged in unit order, independent of which worker ran what.
+
+Frames are a ``<BI`` header (type, length) followed by a marshalled payload.
+A work unit is ``(id, kind, script, seed, params)`` with kind ``simulation``,
+running the ``Simulation`` in ``script`` with ``params`` set as module
+globals, or ``diff``, running ``differential.diff`` for port ``script``.
+"""
+import logging
+import marshal
+import random
+import socket
+import SocketServer
+import struct
+import threading
+import time
+import traceback
+
+from sim import Simulation, load_class, set_constants
+
+HEADER = struct.Struct("<BI")
+REQUEST, UNIT, RESULT, DONE = range(4)
+MAX_ATTEMPTS = 3
+
+
+def send(sock, kind, payload=None):
+    data = marshal.dumps(payload)
+    sock.sendall(HEADER.pack(kind, len(data)) + data)
+
+
+def _read(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return "".join(chunks)
+
+
+def receive(sock):
+    kind, length = HEADER.unpack(_read(sock, HEADER.size))
+    return kind, marshal.loads(_read(sock, length))
+
+
+def run_unit(unit):
+    """Run a work unit, return ``(ok, detail)``"""
+    _, kind, script, seed, params = unit
+    random.seed(seed)
+    try:
+        if kind == 'diff':
+            import differential
+            result = differential.diff(script, differential.random_txs(seed, params.get('txs', 10000)),
+                                       params.get('strict', False))
+            return result is None, differential.describe(script, seed, result, params.get('txs', 10000))
+
+        simulation_class = load_class(script, Simulation)
+        set_constants(simulation_class, params)
+        simulation_class().run_all()
+        return True, None
+    except Exception:
+        return False, traceback.format_exc().strip().splitlines()[-1]
+
+
+class Work(object):
+    """Units, their attempts and results, shared by the coordinator threads"""
+
+    def __init__(self, units):
+        self.units = dict((unit[0], unit) for unit in units)
+        self.queue = [unit[0] for unit in units]
+        self.running = {}
+        # Unit -> number of workers lost while running it
+        self.attempts = dict((uid, 0) for uid in self.units)
+        self.connected = 0
+        self.results = {}
+        self.lock = threading.Condition()
+
+    def done(self):
+        return len(self.results) == len(self.units)
+
+    def take(self, worker):
+        with self.lock:
+            while self.queue:
+                uid = self.queue.pop(0)
+                if uid not in self.results:
+                    break
+            else:
+                # Steal the oldest unit still running on another worker
+                running = sorted((started, uid) for uid, (workers, started) in self.running.items()
+                                 if worker not in workers)
+                if not running:
+                    return None
+                uid = running[0][1]
+            workers, started = self.running.setdefault(uid, (set(), time.time()))
+            workers.add(worker)
+            return self.units[uid]
+
+    def finish(self, worker, uid, result):
+        with self.lock:
+            self.running.pop(uid, None)
+            self.results.setdefault(uid, result)
+            self.lock.notify_all()
+
+    def abandon(self, worker):
+        """Queue the units of a lost ``worker`` again"""
+        with self.lock:
+            for uid, (workers, started) in self.running.items():
+                if worker not in workers:
+                    continue
+                workers.discard(worker)
+                self.attempts[uid] += 1
+                if workers or uid in self.results:
+                    continue
+                del self.running[uid]
+                if self.attempts[uid] < MAX_ATTEMPTS:
+                    self.queue.insert(0, uid)
+                else:
+                    self.results[uid] = (False, "Gave up after %d attempts" % MAX_ATTEMPTS)
+            self.lock.notify_all()
+
+    def fail_remaining(self, detail):
+        with self.lock:
+            for uid in self.units:
+                self.results.setdefault(uid, (False, detail))
+            self.running.clear()
+            self.queue = []
+            self.lock.notify_all()
+
+
+class CoordinatorHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        work = self.server.work
+        worker = self.client_address
+        with work.lock:
+            work.connected += 1
+        try:
+            while True:
+                kind, _ = receive(self.request)
+                if kind != REQUEST:
+                    raise ValueError("Unexpected frame %d" % kind)
+                while True:
+                    unit = work.take(worker)
+                    if unit is None:
+                        send(self.request, DONE)
+                        return
+                    try:
+                        send(self.request, UNIT, unit)
+                        break
+                    except ValueError as e:
+                        # Not the worker's fault, fail the unit rather than retry it
+                        work.finish(worker, unit[0], (False, "Cannot send unit: %s" % e))
+                kind, (uid, ok, detail) = receive(self.request)
+                work.finish(worker, uid, (ok, detail))
+        except (EOFError, socket.error) as e:
+            logging.warn("Lost worker %s:%d: %s" % (worker + (e,)))
+        finally:
+            with work.lock:
+                work.connected -= 1
+            work.abandon(worker)
+
+
+class Coordinator(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, units):
+        SocketServer.TCPServer.__init__(self, address, CoordinatorHandler)
+        self.work = Work(units)
+
+    def results(self, spawn=None, local=0):
+        """Serve until every unit has a result, return them in unit order.
+
+        ``spawn()`` starts a local worker process, ``local`` of them are kept
+        running. Each unit may cost at most ``MAX_ATTEMPTS`` of them.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        workers = [spawn() for _ in range(local)]
+        spawns = len(self.work.units) * MAX_ATTEMPTS
+        with self.work.lock:
+            while not self.work.done():
+                self.work.lock.wait(0.2)
+                for i, process in enumerate(workers):
+                    if process is None or process.poll() is None:
+                        continue
+                    if spawns > 0:
+                        logging.warn("Local worker exited with %d, starting another" % process.returncode)
+                        spawns -= 1
+                        workers[i] = spawn()
+                    else:
+                        workers[i] = None
+                if workers and not any(workers) and not self.work.connected:
+                    self.work.fail_remaining("No workers left")
+        for process in workers:
+            if process is not None:
+                process.wait()
+        self.shutdown()
+        self.server_close()
+        return [(self.work.units[uid], self.work.results[uid]) for uid in sorted(self.work.units)]
+
+
+def worker(address):
+    """Pull and run units from the coordinator at ``address`` until it is done"""
+    sock = socket.create_connection(address)
+    try:
+        while True:
+            send(sock, REQUEST)
+            kind, unit = receive(sock)
+            if kind == DONE:
+                return
+            ok, detail = run_unit(unit)
+            send(sock, RESULT, (unit[0], ok, detail))
+    finally:
+        sock.close()
+
+
+def make_units(kind, scripts, seeds, grid):
+    """Enumerate units for every script, parameter point of ``grid`` and seed.
+
+    ``grid`` maps a parameter name to the list of its values, which must be
+    marshallable to reach the workers. Fractions parsed as ``Decimal`` are not,
+    they raise ``ValueError``.
+    """
+    for name, values in grid.items():
+        for value in values:
+            try:
+                marshal.dumps(value)
+            except ValueError:
+                raise ValueError("Parameter %s=%s cannot be sent to workers, use an int or a string" %
+                                 (name, value))
+    points = [{}]
+    for name in sorted(grid):
+        points = [dict(point, **{name: value}) for point in points for value in grid[name]]
+    units = []
+    for script in scripts:
+        for point in points:
+            for seed in seeds:
+                units.append((len(units), kind, script, seed, point))
+    return units
@@ -0,0 +1,145 @@
+"""Long-lived simulator speaking line-delimited JSON over a local socket.
+
+Every connection is a session with its own contract and block. Requests are
+JSON objects with an ``op``:
+
+    {"op": "load", "script": "examples/subcurrency.py", "constants": {"MYCREATOR": "alice"}}
+    {"op": "tx", "sender": "alice", "value": 100, "data": ["bob", 1000], "block": {"timestamp": 0}}
+    {"op": "balance", "account": "bob", "value": 1000}
+    {"op": "storage"}
+
+and every request gets one JSON line back with ``"ok": true`` or an ``"error"``.
+"""
+import json
+import logging
+import os
+import SocketServer
+import threading
+import time
+import traceback
+
+from sim import Block, Simulation, Tx, set_constants
+
+# Block attributes a tx request may set
+BLOCK_FIELDS = ('number', 'timestamp', 'difficulty', 'parenthash')
+
+
+class Session(object):
+
+    def __init__(self):
+        self.contract = None
+        self.constants = {}
+        self.block = Block()
+        self.simulation = Simulation()
+
+
+class Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        session = Session()
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                response = self.server.dispatch(session, json.loads(line))
+                response['ok'] = True
+            except Exception as e:
+                logging.debug(traceback.format_exc())
+                response = {'ok': False, 'error': "%s: %s" % (e.__class__.__name__, e)}
+            self.wfile.write(json.dumps(response, default=str) + "\n")
+            self.wfile.flush()
+
+
+class SimulationServerMixin(object):
+
+    def setup_simulation(self, load_contract_class):
+        self.load_contract_class = load_contract_class
+        self.contract_classes = {}
+        # Python contracts read constants as module globals, so runs are serialized
+        self.lock = threading.Lock()
+
+    def dispatch(self, session, request):
+        op = request.get('op')
+        handler = getattr(self, 'op_%s' % op, None)
+        if handler is None:
+            raise ValueError("Unknown op %r" % op)
+        with self.lock:
+            return handler(session, request)
+
+    def op_load(self, session, request):
+        script = request['script']
+        if script not in self.contract_classes:
+            self.contract_classes[script] = self.load_contract_class(script)
+        contract_class = self.contract_classes[script]
+
+        session.constants = request.get('constants', {})
+        session.contract = contract_class(**session.constants)
+        session.block = Block()
+        return {'contract': contract_class.__name__}
+
+    def op_balance(self, session, request):
+        session.block.set_account_balance(request['account'], request['value'])
+        return {}
+
+    def op_storage(self, session, request):
+        return {'storage': session.contract.storage._storage.items()}
+
+    def op_tx(self, session, request):
+        contract = session.contract
+        if contract is None:
+            raise RuntimeError("No contract loaded")
+        start = time.time()
+
+        fields = request.get('block', {})
+        for name in fields:
+            if name not in BLOCK_FIELDS:
+                raise ValueError("Unknown block field %s, use one of %s" % (name, ", ".join(BLOCK_FIELDS)))
+        set_constants(contract.__class__, session.constants)
+        for name, value in fields.items():
+            setattr(session.block, name, value)
+
+        tx = Tx(sender=request.get('sender'), value=request.get('value', 0),
+                fee=request.get('fee', 0), data=request.get('data', []))
+        # Keys written by the tx, reads of missing keys are not changes
+        written = {}
+        contract.storage.on_write = written.__setitem__
+        try:
+            session.simulation.run(tx, contract, session.block, method_name="session")
+        finally:
+            del contract.storage.on_write
+
+        return {'stopped': session.simulation.stopped,
+                'storage': written.items(),
+                'txs': contract.txs,
+                'us': int((time.time() - start) * 10 ** 6)}
+
+
+# The mixin comes last as the SocketServer classes are old-style, so the
+# attributes overriding theirs are set on the servers themselves
+
+class UnixSimulationServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer, SimulationServerMixin):
+
+    daemon_threads = True
+
+
+class TCPSimulationServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, SimulationServerMixin):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address, load_contract_class):
+    """Serve on a Unix socket path, or on ``(host, port)``"""
+    if isinstance(address, tuple):
+        server = TCPSimulationServer(address, Handler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = UnixSimulationServer(address, Handler)
+    server.setup_simulation(load_contract_class)
+
+    logging.warn("Serving on %s" % (address,))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,138 @@
+"""Differential runs of the .cll originals against their Python ports.
+
+Both implementations get the same generated tx stream in lockstep. After
+every tx the stop outcome, the storage keys written by either side and the
+emitted txs are compared, and the first divergence is reported.
+"""
+from collections import namedtuple
+import copy
+import multiprocessing
+import random
+import traceback
+
+from sim import Block, Contract, Simulation, Tx, load_class, set_constants
+
+# name: (python port, cll original, constants)
+PORTS = {
+    'namecoin': ('examples/namecoin.py', 'examples/namecoin.cll', {}),
+    'fountain': ('examples/fountain.py', 'examples/fountain.cll', {}),
+    'datafeed': ('examples/datafeed.py', 'examples/datafeed.cll', {'FEEDOWNER': 'alice'}),
+    'hedging': ('examples/hedging.py', 'examples/hedging.cll', {'A': 'alice', 'D': 'datafeed', 'I': 'USD'}),
+    # The port names the verifier SHIPPER and the price PRICE_ETHER, and its
+    # MIN_FEE is lowered to the 100 of the original
+    'escrow': ('examples/escrow.py', 'examples/escrow.cll',
+               {'MERCHANT': 'carol', 'SHIPPER': 'bob', 'VERIFIER': 'bob', 'PRICE_ETHER': 2000, 'PRICE': 2000,
+                'MIN_FEE': 100}),
+}
+
+SENDERS = ['alice', 'bob', 'carol']
+VALUES = [0, 10, 100, 200, 1000, 2000, 10 ** 21]
+DATA = ['alice', 'bob', 'USD', 'ethereum.bit', 0, 1, 150, 1000]
+
+Outcome = namedtuple('Outcome', ['stopped', 'storage', 'txs'])
+Divergence = namedtuple('Divergence', ['index', 'tx', 'python', 'cll'])
+
+
+class CllContract(Contract):
+    """Runs the CLL ``script`` through ``Contract.load``"""
+
+    def __init__(self, script, **constants):
+        Contract.__init__(self, **constants)
+        self.script = script
+
+    def run(self, tx, contract, block):
+        Contract.load(self, self.script, tx, contract, block)
+
+
+def random_txs(seed, n):
+    """Yield ``n`` reproducible ``(tx, block)`` pairs"""
+    rnd = random.Random(seed)
+    for i in range(n):
+        tx = Tx(sender=rnd.choice(SENDERS), value=rnd.choice(VALUES),
+                data=[rnd.choice(DATA) for _ in range(rnd.randint(0, 3))])
+        block = Block(timestamp=rnd.randint(0, 60 * 86400), number=i + 1)
+        block.set_account_balance(rnd.choice(SENDERS), rnd.choice(VALUES))
+        block.contract_storage('datafeed')['USD'] = rnd.choice([0, 400, 2500, 4000])
+        yield tx, block
+
+
+def make_contracts(name):
+    python_script, cll_script, constants = PORTS[name]
+    contract_class = load_class(python_script, Contract)
+    set_constants(contract_class, constants)
+    return contract_class(**constants), CllContract(cll_script, **constants)
+
+
+def _track_writes(contract):
+    written = set()
+    contract.storage.on_write = lambda key, value: written.add(key)
+    return written
+
+
+def _outcome(simulation, contract, tx, block, strict):
+    try:
+        simulation.run(tx, contract, block, method_name="differential")
+        stopped = simulation.stopped if strict else bool(simulation.stopped)
+    except Exception as e:
+        stopped = "%s: %s" % (e.__class__.__name__, e)
+    return stopped, contract.storage._storage, list(contract.txs)
+
+
+def diff(name, txs, strict=False):
+    """Return the first ``Divergence`` of port ``name`` over ``txs``, or None.
+
+    Without ``strict`` only whether a tx stopped is compared, as the .cll
+    originals stop without the messages of their ports.
+    """
+    python, cll = make_contracts(name)
+    python_written, cll_written = _track_writes(python), _track_writes(cll)
+    python_sim, cll_sim = Simulation(), Simulation()
+
+    for i, (tx, block) in enumerate(txs):
+        # Each side gets its own block, changes by one must not reach the other
+        cll_block = copy.deepcopy(block)
+        python_stopped, python_storage, python_txs = _outcome(python_sim, python, tx, block, strict)
+        cll_stopped, cll_storage, cll_txs = _outcome(cll_sim, cll, tx, cll_block, strict)
+
+        keys = python_written | cll_written
+        python_changes = dict((k, python_storage.get(k, 0)) for k in keys)
+        cll_changes = dict((k, cll_storage.get(k, 0)) for k in keys)
+        python_written.clear()
+        cll_written.clear()
+
+        if python_stopped != cll_stopped or python_changes != cll_changes or python_txs != cll_txs:
+            return Divergence(i, tx, Outcome(python_stopped, python_changes, python_txs),
+                              Outcome(cll_stopped, cll_changes, cll_txs))
+    return None
+
+
+def _check(job):
+    name, seed, n, strict = job
+    try:
+        return name, seed, diff(name, random_txs(seed, n), strict)
+    except Exception:
+        return name, seed, traceback.format_exc()
+
+
+def run_ports(names, seeds, n, strict=False, processes=None):
+    """Diff every port in ``names`` over ``n`` txs for each seed in worker processes.
+
+    Returns ``(name, seed, result)`` tuples in job order, where result is None,
+    a ``Divergence`` or the traceback of a harness failure.
+    """
+    jobs = [(name, seed, n, strict) for name in names for seed in seeds]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_check, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def describe(name, seed, result, n):
+    if result is None:
+        return "%s seed %d: %d txs agree" % (name, seed, n)
+    if isinstance(result, Divergence):
+        return ("%s seed %d: diverged at tx %d %s\n  python: %s\n  cll:    %s" %
+                (name, seed, result.index, result.tx, result.python, result.cll))
+    return "%s seed %d: harness failed\n%s" % (name, seed, result)
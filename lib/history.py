@@ -0,0 +1,184 @@
+"""Time-travel index over long runs.
+
+A ``Recorder`` attached to ``Simulation.recorder`` deep-copies the contract
+and block every ``interval`` txs and logs every change in between: writes to
+the contract storage and to every ``block.contract_storage``, balance
+changes, changes of the block attributes and switches to another block. The
+state before any tx is rebuilt from the nearest checkpoint and at most
+``interval`` txs worth of changes.
+
+A switch to another block logs only the attributes it changes and what the
+new block already holds, so the fresh block ``Simulation.run`` makes for
+every tx without one costs next to nothing.
+"""
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+import copy
+
+from sim import Storage
+
+STORAGE = 's'
+BALANCE = 'b'
+# Key (address, key) of block.contract_storage(address)[key]
+CONTRACT_STORAGE = 'c'
+# Changed block attributes such as number and timestamp, key None
+ATTRS = 'a'
+# Switch to another block, key None, value (changed attributes, balances,
+# address -> storage contents or None for the contract storage), the latter
+# two None when empty, or None for a pristine block with the same attributes
+BLOCK = 'k'
+
+
+def _attrs(block):
+    return dict((name, value) for name, value in block.__dict__.items()
+                if name not in ('_storages', '_balances', 'on_balance'))
+
+
+def _changes(old, new):
+    return dict((name, value) for name, value in new.items()
+                if name not in old or old[name] != value)
+
+
+class Recorder(object):
+
+    def __init__(self, interval=1000):
+        self.interval = interval
+        self.contract = None
+        self.block = None
+        self.attrs = None
+        # Log position at which every tx started
+        self.starts = array('l')
+        # Tx index -> deep copy of (contract, block) taken before it
+        self.checkpoints = {}
+        self.checkpoint_txs = []
+        self.targets = []
+        self.keys = []
+        self.values = []
+        self.positions = defaultdict(list)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def before_tx(self, contract, block):
+        n = len(self.starts)
+        checkpoint = n % self.interval == 0
+        if contract is not self.contract:
+            self._attach(contract, block)
+            checkpoint = True
+        elif block is not self.block:
+            # Simulation.run makes a new block for every tx without one
+            attrs = self.attrs
+            self._attach(contract, block)
+            storages = dict((address, None if storage is contract.storage else dict(storage._storage))
+                            for address, storage in block._storages.items()
+                            if storage is contract.storage or storage._storage)
+            changes = _changes(attrs, self.attrs)
+            if changes or block._balances or storages:
+                self._log(BLOCK, None, (changes, dict(block._balances) or None, storages or None))
+            else:
+                self._log(BLOCK, None, None)
+        elif len(block._storages) != self.storages:
+            self._hook_storages()
+        attrs = _attrs(block)
+        if attrs != self.attrs:
+            self._log(ATTRS, None, _changes(self.attrs, attrs))
+            self.attrs = attrs
+        if checkpoint:
+            self._checkpoint(n)
+        self.starts.append(len(self.keys))
+
+    def detach(self):
+        """Remove the hooks from the contract and block, stop logging"""
+        if self.contract is not None:
+            self.contract.storage.__dict__.pop('on_write', None)
+        if self.block is not None:
+            self.block.__dict__.pop('on_balance', None)
+            for storage in self.block._storages.values():
+                storage.__dict__.pop('on_write', None)
+        self.contract = self.block = None
+
+    def _attach(self, contract, block):
+        self.detach()
+        self.contract, self.block = contract, block
+        self.attrs = _attrs(block)
+        contract.storage.on_write = lambda key, value: self._log(STORAGE, key, value)
+        block.on_balance = lambda account, value: self._log(BALANCE, account, value)
+        for address, storage in block._storages.items():
+            if storage is not contract.storage:
+                self._hook(address, storage)
+        self.storages = len(block._storages)
+
+    def _hook(self, address, storage):
+        storage.on_write = lambda key, value: self._log(CONTRACT_STORAGE, (address, key), value)
+
+    def _hook_storages(self):
+        """Hook the block storages created since the last tx, logging what they hold.
+
+        Storages are only ever added to a block, so this runs only when their
+        number changed.
+        """
+        for address, storage in self.block._storages.items():
+            if 'on_write' not in storage.__dict__ and storage is not self.contract.storage:
+                for key, value in storage._storage.items():
+                    self._log(CONTRACT_STORAGE, (address, key), value)
+                self._hook(address, storage)
+        self.storages = len(self.block._storages)
+
+    def _checkpoint(self, n):
+        if n not in self.checkpoints:
+            self.checkpoint_txs.append(n)
+        self.checkpoints[n] = copy.deepcopy((self.contract, self.block))
+
+    def _log(self, target, key, value):
+        if key is not None:
+            self.positions[target, key].append(len(self.keys))
+        self.targets.append(target)
+        self.keys.append(key)
+        self.values.append(value)
+
+    def seek(self, n):
+        """Return copies of ``(contract, block)`` as they were before tx ``n``"""
+        if not 0 <= n < len(self.starts):
+            raise IndexError("No tx %d recorded" % n)
+        c = self.checkpoint_txs[bisect_right(self.checkpoint_txs, n) - 1]
+        contract, block = copy.deepcopy(self.checkpoints[c])
+        for i in xrange(self.starts[c], self.starts[n]):
+            target, key, value = self.targets[i], self.keys[i], self.values[i]
+            if target == STORAGE:
+                contract.storage._storage[key] = value
+            elif target == BALANCE:
+                block._balances[key] = value
+            elif target == CONTRACT_STORAGE:
+                block._storages[key[0]]._storage[key[1]] = value
+            elif target == ATTRS:
+                block.__dict__.update(value)
+            else:
+                block = self._rebuild(block, contract, *(value or ({}, None, None)))
+        return contract, block
+
+    @staticmethod
+    def _rebuild(block, contract, changes, balances, storages):
+        """Return the block switched to from ``block`` by a BLOCK entry"""
+        new = block.__class__.__new__(block.__class__)
+        new.__dict__.update(_attrs(block))
+        new.__dict__.update(changes)
+        new._storages = defaultdict(Storage)
+        new._balances = defaultdict(int)
+        new._balances.update(balances or {})
+        for address, contents in (storages or {}).items():
+            if contents is None:
+                new._storages[address] = contract.storage
+            else:
+                new._storages[address]._storage.update(contents)
+        return new
+
+    def history(self, key, target=STORAGE):
+        """Return ``(tx index, value)`` of every write to storage ``key``.
+
+        With ``target=BALANCE`` list the balance changes of account ``key``,
+        with ``target=CONTRACT_STORAGE`` the writes to ``(address, key)`` of
+        ``block.contract_storage(address)``.
+        Writes made between two txs count towards the earlier one.
+        """
+        return [(bisect_right(self.starts, i) - 1, self.values[i]) for i in self.positions[target, key]]
@@ -0,0 +1,166 @@
+"""Line and branch coverage by rewriting contract code at load time.
+
+Every statement inside a function gets a ``_cov_N[k] += 1`` in front of it
+and every ``if``/``while`` body and else clause one for the branch taken. The
+counters live in one preallocated ``array`` per instrumented unit, so the
+overhead is a single indexed increment per statement.
+"""
+from array import array
+from collections import defaultdict
+import ast
+import inspect
+import sys
+import textwrap
+
+from sim import get_subclasses, Contract
+
+
+class Unit(object):
+    """Counters of one instrumented piece of code"""
+
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+        self.counters = None
+        # counter index -> (source line, None) or (source line, branch)
+        self.points = []
+
+
+class Instrumenter(ast.NodeTransformer):
+
+    def __init__(self, unit, lineof):
+        self.unit = unit
+        self.lineof = lineof
+        self.line_counters = {}
+
+    def counter(self, index, node):
+        target = ast.Subscript(value=ast.Name(id=self.unit.name, ctx=ast.Load()),
+                               slice=ast.Index(value=ast.Num(n=index)), ctx=ast.Store())
+        return ast.copy_location(ast.AugAssign(target=target, op=ast.Add(), value=ast.Num(n=1)), node)
+
+    def new_point(self, line, branch):
+        self.unit.points.append((line, branch))
+        return len(self.unit.points) - 1
+
+    def instrument_body(self, stmts):
+        body = []
+        for stmt in stmts:
+            line = self.lineof(stmt.lineno)
+            if line not in self.line_counters:
+                self.line_counters[line] = self.new_point(line, None)
+            body.append(self.counter(self.line_counters[line], stmt))
+            body.append(self.visit(stmt))
+        return body
+
+    def branch(self, node, kind, stmts):
+        index = self.new_point(self.lineof(node.lineno), kind)
+        return [self.counter(index, node)] + self.instrument_body(stmts)
+
+    def visit_FunctionDef(self, node):
+        node.body = self.instrument_body(node.body)
+        return node
+
+    def visit_If(self, node):
+        node.test = self.visit(node.test)
+        node.body = self.branch(node, 'true', node.body)
+        node.orelse = self.branch(node, 'false', node.orelse)
+        return node
+
+    def visit_While(self, node):
+        node.test = self.visit(node.test)
+        node.body = self.branch(node, 'loop', node.body)
+        node.orelse = self.branch(node, 'exit', node.orelse)
+        return node
+
+    def generic_visit(self, node):
+        if isinstance(node, (ast.Module, ast.ClassDef)):
+            return ast.NodeTransformer.generic_visit(self, node)
+        # Other compound statements, expressions hold no statements to count
+        for field in ('body', 'orelse', 'finalbody'):
+            if isinstance(getattr(node, field, None), list):
+                setattr(node, field, self.instrument_body(getattr(node, field)))
+        for handler in getattr(node, 'handlers', []):
+            handler.body = self.instrument_body(handler.body)
+        return node
+
+
+class Coverage(object):
+    """Collects line and branch counts of instrumented contracts"""
+
+    def __init__(self):
+        self.units = []
+        # script -> (translated closure, code object, unit) instrumented once
+        # for all contracts loading it
+        self.scripts = {}
+
+    def _instrument(self, tree, source, namespace, lineof):
+        unit = Unit(source, "_cov_%d" % len(self.units))
+        tree = ast.fix_missing_locations(Instrumenter(unit, lineof).visit(tree))
+        unit.counters = array('l', [0] * len(unit.points))
+        namespace[unit.name] = unit.counters
+        self.units.append(unit)
+        return tree
+
+    def instrument(self, closure, script, namespace, linemap):
+        """Return the code object of the translated ``closure`` of ``script``"""
+        cached = self.scripts.get(script)
+        if cached is not None and cached[0] == closure:
+            _, code, unit = cached
+            namespace[unit.name] = unit.counters
+            return code
+
+        def lineof(lineno):
+            return linemap[min(lineno, len(linemap)) - 1]
+
+        tree = self._instrument(ast.parse(closure), script, namespace, lineof)
+        code = compile(tree, script, 'exec')
+        self.scripts[script] = (closure, code, self.units[-1])
+        return code
+
+    def instrument_class(self, cls):
+        """Replace the methods of ``cls`` by instrumented copies"""
+        module = sys.modules[cls.__module__]
+        lines, firstlineno = inspect.getsourcelines(cls)
+        tree = ast.parse(textwrap.dedent("".join(lines)))
+        ast.increment_lineno(tree, firstlineno - 1)
+
+        tree = self._instrument(tree, module.__file__.replace('.pyc', '.py'), module.__dict__, lambda n: n)
+        namespace = {}
+        for node in tree.body[0].body:
+            if isinstance(node, ast.FunctionDef):
+                exec(compile(ast.Module(body=[node]), self.units[-1].source, 'exec'), module.__dict__, namespace)
+                setattr(cls, node.name, namespace[node.name])
+
+    def instrument_module(self, module):
+        for cls in get_subclasses(module, Contract):
+            self.instrument_class(cls)
+
+    def counts(self):
+        """Return ``{source: ({line: hits}, {(line, branch): hits})}``"""
+        result = defaultdict(lambda: (defaultdict(int), defaultdict(int)))
+        for unit in self.units:
+            lines, branches = result[unit.source]
+            for (line, branch), hits in zip(unit.points, unit.counters):
+                if branch is None:
+                    lines[line] += hits
+                else:
+                    branches[line, branch] += hits
+        return result
+
+    def report(self):
+        out = []
+        for source, (lines, branches) in sorted(self.counts().items()):
+            with open(source) as fp:
+                text = fp.read().splitlines()
+            hit_lines = sum(1 for hits in lines.values() if hits)
+            hit_branches = sum(1 for hits in branches.values() if hits)
+            out.append("%s: %d/%d lines, %d/%d branches" %
+                       (source, hit_lines, len(lines), hit_branches, len(branches)))
+            for line in sorted(set(lines) | set(number for number, _ in branches)):
+                missed = [branch for (number, branch), hits in sorted(branches.items())
+                          if number == line and not hits]
+                if lines.get(line, 1) and not missed:
+                    continue
+                out.append("  %4d %6d  %-50s %s" % (line, lines.get(line, 0), text[line - 1].strip()[:50],
+                                                    "missed: " + ", ".join(missed) if missed else ""))
+        return "\n".join(out)
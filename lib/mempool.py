@@ -0,0 +1,112 @@
+from collections import defaultdict, namedtuple
+import heapq
+import itertools
+import logging
+
+from sim import Block
+
+Receipt = namedtuple('Receipt', ['tx', 'stopped', 'txs'])
+
+
+class Mempool(object):
+    """Pending transactions, highest fee first and in nonce order per sender.
+
+    Only the lowest pending nonce of every sender competes in the fee heap, so
+    both ``add`` and ``pop`` are O(log n). Transactions without a nonce get
+    the next free nonce of their sender. A tx with the nonce of a pending tx
+    of the same sender replaces it if it pays a higher fee, otherwise ``add``
+    raises ``ValueError``.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # sender -> {nonce: tx} and the heap of those nonces
+        self._pending = defaultdict(dict)
+        self._queues = defaultdict(list)
+        self._nonces = defaultdict(int)
+        self._assigned = defaultdict(int)
+        # sender -> counter of its current entry in the fee heap
+        self._ready = {}
+        self._counter = itertools.count()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, tx):
+        sender = tx.sender
+        if tx.nonce is None:
+            tx.nonce = self._assigned[sender]
+        if tx.nonce < self._nonces[sender]:
+            raise ValueError("Nonce %d of %s already used" % (tx.nonce, sender))
+        self._assigned[sender] = max(self._assigned[sender], tx.nonce + 1)
+
+        pending = self._pending[sender]
+        if tx.nonce in pending:
+            if tx.fee <= pending[tx.nonce].fee:
+                raise ValueError("Nonce %d of %s already pending with a fee of %s" %
+                                 (tx.nonce, sender, pending[tx.nonce].fee))
+            pending[tx.nonce] = tx
+            if tx.nonce == self._nonces[sender]:
+                # Compete with the new fee, the old heap entry goes stale
+                self._ready.pop(sender, None)
+                self._schedule(sender)
+            return
+
+        pending[tx.nonce] = tx
+        heapq.heappush(self._queues[sender], tx.nonce)
+        self._len += 1
+        self._schedule(sender)
+
+    def pop(self):
+        """Remove and return the executable tx paying the highest fee"""
+        while self._heap:
+            _, counter, sender = heapq.heappop(self._heap)
+            # Skip entries left behind by replaced txs
+            if self._ready.get(sender) != counter:
+                continue
+            del self._ready[sender]
+            nonce = heapq.heappop(self._queues[sender])
+            tx = self._pending[sender].pop(nonce)
+            self._len -= 1
+            self._nonces[sender] = nonce + 1
+            self._schedule(sender)
+            return tx
+        raise IndexError("pop from empty mempool")
+
+    def _schedule(self, sender):
+        queue = self._queues[sender]
+        if not queue:
+            del self._queues[sender]
+            del self._pending[sender]
+            return
+        if sender in self._ready or queue[0] != self._nonces[sender]:
+            return
+        self._ready[sender] = counter = next(self._counter)
+        heapq.heappush(self._heap, (-self._pending[sender][queue[0]].fee, counter, sender))
+
+
+class BlockBuilder(object):
+    """Packs transactions from a ``Mempool`` into blocks and executes them"""
+
+    def __init__(self, mempool, simulation, limit=100):
+        self.mempool = mempool
+        self.simulation = simulation
+        self.limit = limit
+
+    def build(self, contract, block=None):
+        """Run up to ``limit`` pending txs against ``contract`` in one block"""
+        if block is None:
+            block = Block()
+
+        receipts = []
+        while len(receipts) < self.limit:
+            try:
+                tx = self.mempool.pop()
+            except IndexError:
+                break
+            self.simulation.run(tx, contract, block, method_name="block %d" % block.number)
+            receipts.append(Receipt(tx, self.simulation.stopped, contract.txs))
+
+        logging.info("Block %d: %d txs, %d pending" % (block.number, len(receipts), len(self.mempool)))
+        return receipts
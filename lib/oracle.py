@@ -0,0 +1,83 @@
+"""Drive datafeed contracts from time series and interleave consumer txs.
+
+A ``Driver`` runs a deterministic event loop over simulated time. Every
+series update becomes a tx from the feed owner to its datafeed contract and
+every consumer tx runs against its contract, all in timestamp order on one
+shared ``Block`` whose ``contract_storage`` exposes the datafeed storages.
+Only the next event of every source is held in memory.
+"""
+import csv
+import heapq
+import itertools
+import json
+
+from replay import parse_number
+from sim import Block, Tx
+
+# Feed updates go first when they share a timestamp with consumer txs
+FEED, CONSUMER = 0, 1
+
+
+def read_series(path):
+    """Yield ``(timestamp, value)`` from a ``.csv`` or ``.jsonl`` file.
+
+    CSV files have a header with ``timestamp`` and ``value`` columns, JSON
+    lines are objects with the same keys.
+    """
+    with open(path, 'rb') as fp:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(fp):
+                yield parse_number(row['timestamp']), parse_number(row['value'])
+        else:
+            for line in fp:
+                if line.strip():
+                    obj = json.loads(line, parse_float=parse_number)
+                    yield obj['timestamp'], obj['value']
+
+
+class Driver(object):
+
+    def __init__(self, simulation, block=None):
+        self.simulation = simulation
+        self.block = Block() if block is None else block
+        self.events = []
+        self.counter = itertools.count()
+
+    def _push(self, priority, source, handler):
+        for item in source:
+            heapq.heappush(self.events, (item[0], priority, next(self.counter), item, source, handler))
+            return
+
+    def add_feed(self, contract, address, series, key, owner):
+        """Publish ``series`` of ``(timestamp, value)`` as ``key`` through ``contract``.
+
+        The contract storage becomes ``block.contract_storage(address)``.
+        """
+        self.block._storages[address] = contract.storage
+
+        def publish(item):
+            timestamp, value = item
+            tx = Tx(sender=owner, data=[key, value])
+            self.simulation.run(tx, contract, self.block, method_name="feed %s" % address)
+
+        self._push(FEED, iter(series), publish)
+
+    def add_txs(self, contract, txs):
+        """Run ``txs`` of ``(timestamp, tx)`` against ``contract``"""
+        def consume(item):
+            self.simulation.run(item[1], contract, self.block, method_name="consumer")
+
+        self._push(CONSUMER, iter(txs), consume)
+
+    def run(self, until=None):
+        """Process events up to timestamp ``until``, return how many ran"""
+        n = 0
+        while self.events and (until is None or self.events[0][0] <= until):
+            timestamp, priority, _, item, source, handler = heapq.heappop(self.events)
+            if timestamp > self.block.timestamp:
+                self.block.number += 1
+            self.block.timestamp = timestamp
+            handler(item)
+            n += 1
+            self._push(priority, source, handler)
+        return n
@@ -0,0 +1,105 @@
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+import csv
+import itertools
+import json
+import logging
+
+from sim import Block, Tx
+
+TX_FIELDS = ('sender', 'value', 'fee', 'nonce')
+
+
+def parse_number(s):
+    """Parse ``s`` as an exact int, falling back to ``Decimal`` for fractions.
+
+    Amounts like ``1000000000000000000`` or ``1e18`` never pass through float.
+    Infinities and NaN raise ``ValueError``.
+    """
+    try:
+        return int(s)
+    except ValueError:
+        pass
+    d = Decimal(s)
+    if not d.is_finite():
+        raise ValueError("%s is not a finite number" % s)
+    if d == d.to_integral_value():
+        return int(d)
+    return d
+
+
+def parse_value(s):
+    try:
+        return parse_number(s)
+    except (ValueError, InvalidOperation):
+        return s
+
+
+def _make_tx(fields, data):
+    kwargs = dict((k, fields[k]) for k in TX_FIELDS if fields.get(k) not in (None, ''))
+    for k in ('value', 'fee', 'nonce'):
+        if isinstance(kwargs.get(k), basestring):
+            kwargs[k] = parse_number(kwargs[k])
+    return Tx(data=data, **kwargs)
+
+
+def read_jsonl(fp):
+    """Yield a ``Tx`` for every JSON object line of ``fp``"""
+    for line in fp:
+        line = line.strip()
+        if not line:
+            continue
+        obj = json.loads(line, parse_float=parse_number)
+        yield _make_tx(obj, obj.get('data', []))
+
+
+def read_csv(fp):
+    """Yield a ``Tx`` for every row of ``fp``.
+
+    The header names the ``sender``, ``value``, ``fee`` and ``nonce`` columns,
+    every column named ``data`` is appended to ``tx.data`` in order.
+    """
+    reader = csv.reader(fp)
+    header = [name.strip() for name in next(reader)]
+    data_columns = [i for i, name in enumerate(header) if name == 'data']
+    for row in reader:
+        if not row:
+            continue
+        fields = dict(zip(header, row))
+        data = [parse_value(row[i]) for i in data_columns if i < len(row) and row[i] != '']
+        yield _make_tx(fields, data)
+
+
+def read_txs(path):
+    """Lazily read txs from a ``.jsonl`` or ``.csv`` file"""
+    reader = read_csv if path.endswith('.csv') else read_jsonl
+    with open(path, 'rb') as fp:
+        for tx in reader(fp):
+            yield tx
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``"""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def replay(simulation, contract, txs, block=None, chunk_size=1000):
+    """Run ``txs`` against ``contract``, holding at most ``chunk_size`` in memory.
+
+    Returns a ``Counter`` of stop reasons, completed runs count as ``None``.
+    """
+    if block is None:
+        block = Block()
+
+    stops = Counter()
+    for n, chunk in enumerate(chunked(txs, chunk_size)):
+        for tx in chunk:
+            simulation.run(tx, contract, block, method_name="replay")
+            stops[simulation.stopped or None] += 1
+        logging.info("Replayed %d txs" % (n * chunk_size + len(chunk)))
+    return stops
@@ -1,39 +1,158 @@
-from collections import defaultdict
+# copy, inspect and json are imported where used, they make up most of the
+# import time of this module
+from bisect import bisect_left
+from collections import defaultdict, deque
 import os, sys, imp
-import inspect
 import logging
-from operator import itemgetter
+import threading
+import time
+import types
 
-def _modify_frame_global(key, value, stack=None, offset=2):
-    if stack is None:
-        stack = inspect.stack()
-    stack[offset][0].f_globals[key] = value
+def _modify_frame_global(key, value, offset=2):
+    sys._getframe(offset).f_globals[key] = value
 
-def _infer_self(stack=None, offset=2):
-    if stack is None:
-        stack = inspect.stack()
-    return stack[offset][0].f_locals['self']
+def _infer_self(offset=2):
+    return sys._getframe(offset).f_locals['self']
 
 def _is_called_by_contract():
-    self = _infer_self(inspect.stack())
+    self = sys._getframe(2).f_locals.get('self')
     caller_class = self.__class__
     return Contract in caller_class.__bases__
 
+def _debugging():
+    return logging.root.isEnabledFor(logging.DEBUG)
+
 def mktx(recipient, amount, datan, data):
     self = _infer_self()
     logging.info("Sending tx to %s of %s" % (recipient, amount))
+    metrics.counters['sim_mktx_total'] += 1
+    metrics.counters['sim_mktx_value_total'] += amount
     self.txs.append((recipient, amount, datan, data))
 
-def stop(reason):
-    raise Stop(reason)
+def stop(reason, site=None):
+    if site is None:
+        frame = sys._getframe(1)
+        site = "%s:%d" % (os.path.basename(frame.f_code.co_filename), frame.f_lineno)
+    raise Stop(reason, site)
 
 def array(n):
     return [None] * n
 
 log = logging.info
 
+def depends(*names):
+    """Declare the scenario methods a test starts from.
+
+    ``Simulation.run_all`` restores the state reached by running ``names``
+    (and their own dependencies) on a fresh simulation before calling the
+    decorated test, replaying each unique prefix only once.
+    """
+    def decorator(method):
+        method.depends = names
+        return method
+    return decorator
+
+def get_subclasses(mod, cls):
+    """Yield the classes in module ``mod`` that inherit from ``cls``"""
+    for name, obj in sorted(vars(mod).items()):
+        if hasattr(obj, "__bases__") and cls in obj.__bases__:
+            yield obj
+
+def set_constants(cls, constants):
+    """Set ``constants`` as globals of the module defining ``cls``.
+
+    Python contracts and simulations read their constants as module globals.
+    """
+    module = sys.modules.get(cls.__module__)
+    if module is not None:
+        for name, value in constants.items():
+            setattr(module, name, value)
+
+def load_class(script, cls):
+    """Load the Python file ``script`` and return its only subclass of ``cls``"""
+    name = os.path.splitext(os.path.basename(script))[0]
+    module = imp.load_source(name, script)
+
+    found = list(get_subclasses(module, cls))
+    if len(found) < 1:
+        raise RuntimeError("No %s found in %s" % (cls.__name__, script))
+    elif len(found) > 1:
+        raise RuntimeError("Multiple %ss found in %s" % (cls.__name__, script))
+
+    return found[0]
+
+def translate(script, baseindent="", linemap=None):
+    """Translate the CLL ``script`` into Python statements indented by ``baseindent``
+
+    When given, ``linemap`` is extended with the ``script`` line number of
+    every generated line.
+    """
+    closure = ""
+
+    with open(script) as fp:
+        for i, line in enumerate(fp):
+            # Use comments for stop and log messages
+            l = line.strip()
+            if l.startswith("stop"):
+                # Line number as default stop message
+                s = '"line %d"' % i
+                if '//' in line:
+                    s = l.split("//")[1].strip()
+                    if not s.startswith('"'):
+                        s = '"' + s + '"'
+                site = "%s:%d" % (os.path.basename(script), i + 1)
+                line = line.split("stop")[0] + "stop(%s, %r)\n" % (s, site)
+            elif "define" in line:
+                sp = l.split("//")
+                s = sp[1].strip()
+                r = s.split("define")[1].strip().split("=")
+                indent = " " * (len(line) - len(line.lstrip()))
+                line = indent
+                if l.split("//")[0].strip().endswith(":"):
+                    line += "    "
+                line += "log('@ line %d: %s" % (i, s)
+                r[1] = str(r[1])
+                if isinstance(r[0], str):
+                    line += ", %%s as hex: 0x%%s' %% (%s," % r[1]
+                    line += "%s.encode('hex')) + " % r[1]
+                    line += "', as int: %d' % "
+                    line += "int(%s.encode('hex'), 16))\n" % r[1]
+                else:
+                    line += "')\n"
+                line += baseindent + indent + sp[0].replace(r[0].strip(), r[1].strip(), 1) + "\n"
+            elif "//" in line:
+                s = l.split("//")[1].strip()
+                if s.startswith('"'):
+                    s = "log('@ line %d: ' + %s)\n" % (i, s)
+                else:
+                    s = "log('@ line %d: %s')\n" % (i, s)
+                line = line.split("//")[0] + "\n"
+                if l.split("//")[0].strip().endswith(":"):
+                    line += "    "
+                indent = " " * (len(line) - len(line.lstrip()))
+                line += baseindent + indent + s
+
+            # Indent
+            closure += baseindent + line
+            if linemap is not None:
+                linemap.extend([i + 1] * line.count("\n"))
+
+    # Conditionals
+    closure = closure.replace("else if", "elif")
+
+    # Exponents
+    closure = closure.replace("^", "**")
+
+    # Comments
+    closure = closure.replace("//", "#")
+
+    return closure
+
 class Block(object):
 
+    # Called as on_balance(account, value) before every balance change
+    on_balance = None
+
     def __init__(self, timestamp=0, difficulty= 2 ** 22, number=1, parenthash="parenthash"):
         self.timestamp = timestamp
         self.difficulty = difficulty
@@ -43,32 +162,59 @@ class Block(object):
         self._balances = defaultdict(int)
 
     def account_balance(self, account):
-        if _is_called_by_contract():
+        if _debugging() and _is_called_by_contract():
             logging.debug("Accessing account_balance '%s'" % account)
         return self._balances[account]
 
     def set_account_balance(self, account, value):
+        if self.on_balance is not None:
+            self.on_balance(account, value)
         self._balances[account] = value
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('on_balance', None)
+        return state
+
     @property
     def basefee(self):
         return 1
 
     def contract_storage(self, key):
-        if _is_called_by_contract():
+        if _debugging() and _is_called_by_contract():
             logging.debug("Accessing contract_storage '%s'" % key)
         return self._storages[key]
 
 
 class Stop(RuntimeError):
-    pass
+
+    def __init__(self, message="", site=None):
+        RuntimeError.__init__(self, message)
+        # file:line of the stop, a label for metrics that does not vary with
+        # the values formatted into the message
+        self.site = site
 
 
 class Contract(object):
 
+    # Receives every tx emitted by mktx across runs, see Simulation.run
+    tx_sink = None
+
+    # Backend running the scripts passed to load, 'python' or 'bytecode'
+    backend = 'python'
+    # Instructions a bytecode contract may execute per tx, None for the default
+    step_budget = None
+    # instrument.Coverage collecting line and branch counts of loaded scripts
+    coverage = None
+    # Paths of the .cll scripts compiled so far
+    sources = set()
+    # Translations of the .cll scripts shared by all contracts, by path and
+    # by (path, 'bytecode'), see watch.py for invalidating them
+    compiled = {}
+
     @property
     def address(self):
-        return hex(id(self))
+        return self._address
 
     @property
     def contract(self):
@@ -77,6 +223,7 @@ class Contract(object):
     def __init__(self, *args, **kwargs):
         self.storage = Storage()
         self.txs = []
+        self._address = hex(id(self))
 
         caller_module = _infer_self(offset=1)
 
@@ -89,73 +236,60 @@ class Contract(object):
             setattr(caller_module, arg, value)
             _modify_frame_global(arg, value)
 
+    def __deepcopy__(self, memo):
+        import copy
+
+        # The compiled closure is immutable, share it between copies
+        clone = self.__class__.__new__(self.__class__)
+        memo[id(self)] = clone
+        for key, value in self.__dict__.items():
+            if key in ('closure', 'closure_linemap', 'closure_module', 'program', 'tx_sink'):
+                clone.__dict__[key] = value
+            else:
+                clone.__dict__[key] = copy.deepcopy(value, memo)
+        return clone
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('closure_module', None)
+        state.pop('tx_sink', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        set_constants(self.__class__, dict((key, value) for key, value in state.items() if key.isupper()))
+
     def run(self, tx, contract, block):
         raise NotImplementedError("Should have implemented this")
 
     def load(self, script, tx, contract, block):
-        if hasattr(self, "closure_module") and inspect.ismodule(self.closure_module):
+        if self.backend == 'bytecode':
+            return self.load_bytecode(script, tx, contract, block)
+
+        if isinstance(getattr(self, "closure_module", None), types.ModuleType):
             closure = self.closure
             closure_module = self.closure_module
         else:
-            log("Loading %s" % script)
-
-            closure = """
+            start = time.time()
+            self.sources.add(script)
+            compiled = None
+            if getattr(self, "closure", None) is None:
+                if script not in self.compiled:
+                    log("Loading %s" % script)
+
+                    closure = """
 from sim import Block, Contract, Simulation, Tx, log, mktx, stop, array
 class HLL(Contract):
     def run(self, tx, contract, block):
 """
-            baseindent = "        "
-
-            with open(script) as fp:
-                for i, line in enumerate(fp):
-                    # Use comments for stop and log messages
-                    l = line.strip()
-                    if l.startswith("stop"):
-                        # Line number as default stop message
-                        s = "line " + str(i)
-                        if '//' in line:
-                            s = l.split("//")[1].strip()
-                            if not s.startswith('"'):
-                                s = '"' + s + '"'
-                        line = line.split("stop")[0] + "stop(%s)\n" % s
-                    elif "define" in line:
-                        sp = l.split("//")
-                        s = sp[1].strip()
-                        r = s.split("define")[1].strip().split("=")
-                        indent = " " * (len(line) - len(line.lstrip()))
-                        line = indent
-                        if l.split("//")[0].strip().endswith(":"):
-                            line += "    "
-                        line += "log('@ line %d: %s" % (i, s)
-                        r[1] = str(r[1])
-                        if isinstance(r[0], str):
-                            line += ", %%s as hex: 0x%%s' %% (%s," % r[1]
-                            line += "%s.encode('hex')) + " % r[1]
-                            line += "', as int: %d' % "
-                            line += "int(%s.encode('hex'), 16))\n" % r[1]
-                        else:
-                            line += "')\n"
-                        line += baseindent + indent + sp[0].replace(r[0].strip(), r[1].strip(), 1) + "\n"
-                    elif "//" in line:
-                        s = l.split("//")[1].strip()
-                        if s.startswith('"'):
-                            s = "log('@ line %d: ' + %s)\n" % (i, s)
-                        else:
-                            s = "log('@ line %d: %s')\n" % (i, s)
-                        line = line.split("//")[0] + "\n"
-                        if l.split("//")[0].strip().endswith(":"):
-                            line += "    "
-                        indent = " " * (len(line) - len(line.lstrip()))
-                        line += baseindent + indent + s
-
-                    # Indent
-                    closure += baseindent + line
-
-            # Exponents
-            closure = closure.replace("^", "**")
-
-            # Comments
-            closure = closure.replace("//", "#")
+                    linemap = [0] * closure.count("\n")
+                    closure += translate(script, baseindent="        ", linemap=linemap)
+                    self.compiled[script] = closure, linemap, compile(closure, "<string>", "exec")
+                closure, linemap, compiled = self.compiled[script]
+            else:
+                # Restored from a bundle, translated already
+                closure = self.closure
+                linemap = self.closure_linemap
 
             # Initialize module
             closure_module = imp.new_module('hll')
@@ -166,28 +300,142 @@ class HLL(Contract):
 
             # Set self.closure_module for reuse and self.closure for export
             self.closure = closure
+            self.closure_linemap = linemap
             self.closure_module = closure_module
 
             # Execute and run
-            exec(closure, closure_module.__dict__)
+            if self.coverage is not None:
+                code = self.coverage.instrument(closure, script, closure_module.__dict__, linemap)
+            else:
+                code = closure if compiled is None else compiled
+            exec(code, closure_module.__dict__)
+            metrics.observe('sim_cll_compile_seconds', time.time() - start)
 
         h = closure_module.HLL()
+        # mktx appends to the txs of the calling HLL instance
+        h.txs = contract.txs
         h.run(tx, contract, block)
 
+    def load_bytecode(self, script, tx, contract, block):
+        import vm
+
+        if getattr(self, "program", None) is None:
+            if (script, 'bytecode') not in self.compiled:
+                log("Compiling %s" % script)
+                start = time.time()
+                self.compiled[script, 'bytecode'] = vm.compile_cll(script)
+                metrics.observe('sim_cll_compile_seconds', time.time() - start)
+            self.sources.add(script)
+            self.program = self.compiled[script, 'bytecode']
+
+        steps = vm.DEFAULT_STEP_BUDGET if self.step_budget is None else self.step_budget
+        vm.run(self.program, tx, contract, block, self.__dict__, steps)
+
+
+# Attribute values that are not part of the state of a simulation
+ROUTINE_TYPES = (types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+                 types.ModuleType, type, types.ClassType)
+
+
 class Simulation(object):
 
+    _recorder = None
+    # Names of the test_ methods in definition order, found by
+    # discover_tests when None, see cache.DiscoveryIndex
+    tests = None
+
     def __init__(self):
         self.log = logging.info
         self.warn = logging.warn
         self.error = logging.error
+        # Names of the tests run so far, run_all skips them
+        self.completed = []
+        # Prerequisite names -> state after them, see _prefix_state
+        self.snapshots = {}
 
-    def run_all(self):
-        test_methods = [(name, method, method.im_func.func_code.co_firstlineno) for name, method in inspect.getmembers(self, predicate=inspect.ismethod)
-                        if name.startswith('test_')]
+    @property
+    def recorder(self):
+        """history.Recorder indexing the state of every run, None to stop"""
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, recorder):
+        # The hooks of a replaced recorder would keep logging every write
+        if self._recorder is not None and self._recorder is not recorder:
+            self._recorder.detach()
+        self._recorder = recorder
+
+    @classmethod
+    def discover_tests(cls):
+        """Return the names of the test_ methods of ``cls`` sorted by line number"""
+        functions = {}
+        for klass in reversed(cls.__mro__):
+            for name, value in vars(klass).items():
+                if name.startswith('test_') and isinstance(value, types.FunctionType):
+                    functions[name] = value
+        return [name for name, function in
+                sorted(functions.items(), key=lambda item: (item[1].func_code.co_firstlineno, item[0]))]
 
-        # sort by linenr
-        for name, method, linenr in sorted(test_methods, key=itemgetter(2)):
+    def run_all(self):
+        names = self.discover_tests() if self.tests is None else self.tests
+        test_methods = [getattr(self, name) for name in names if name not in self.completed]
+
+        # Tests others depend on, their state is kept after they ran in order
+        needed = set(dep for method in test_methods for dep in getattr(method, 'depends', ()))
+        snapshots = self.snapshots
+        if any(hasattr(method, 'depends') for method in test_methods) and () not in snapshots:
+            snapshots[()] = self._snapshot()
+
+        for method in test_methods:
+            if hasattr(method, 'depends'):
+                self._restore(self._prefix_state(tuple(method.depends), snapshots))
             method()
+            self.completed.append(method.__name__)
+            if method.__name__ in needed:
+                snapshots[(method.__name__,)] = self._snapshot()
+
+    def _prefix_state(self, names, snapshots):
+        """Return the state after the tests ``names`` ran one after the other.
+
+        The state after a single test is the one it left when it ran in
+        order, tests that did not run yet are run on top of their own
+        prerequisites.
+        """
+        if names not in snapshots:
+            if len(names) == 1 and names[0] in self.completed:
+                raise RuntimeError("No state kept after %s, it ran before the simulation was restored "
+                                   "without another test depending on it" % names[0])
+            if len(names) == 1:
+                depends = getattr(getattr(self, names[0]), 'depends', ())
+                self._restore(self._prefix_state(tuple(depends), snapshots))
+            else:
+                self._restore(self._prefix_state(names[:-1], snapshots))
+            logging.info("PREREQUISITE %s" % names[-1])
+            getattr(self, names[-1])()
+            snapshots[names] = self._snapshot()
+        return snapshots[names]
+
+    def state(self):
+        """Return the attributes making up the state of the simulation"""
+        state = {}
+        for name in dir(self):
+            if name.startswith('__') or name in ('recorder', '_recorder', 'tests', 'completed',
+                                                 'snapshots'):
+                continue
+            value = getattr(self, name)
+            if isinstance(value, ROUTINE_TYPES):
+                continue
+            state[name] = value
+        return state
+
+    def _snapshot(self):
+        import copy
+        return copy.deepcopy(self.state())
+
+    def _restore(self, snapshot):
+        import copy
+        for name, value in copy.deepcopy(snapshot).items():
+            setattr(self, name, value)
 
     def run(self, tx, contract, block=None, method_name=None):
         self.stopped = False
@@ -195,12 +443,16 @@ class Simulation(object):
             block = Block()
 
         if method_name is None:
-            method_name = inspect.stack()[1][3]
+            method_name = sys._getframe(1).f_code.co_name
 
         logging.info("RUN %s: %s" % (method_name, tx))
 
+        if self.recorder is not None:
+            self.recorder.before_tx(contract, block)
+
         contract.txs = []
 
+        start = time.time()
         try:
             contract.run(tx, contract, block)
         except Stop as e:
@@ -210,22 +462,79 @@ class Simulation(object):
             else:
                 logging.info("Stopped")
                 self.stopped = True
+            metrics.stop(self.stopped if e.site is None else e.site)
+        finally:
+            metrics.counters['sim_txs_total'] += 1
+            metrics.observe('sim_tx_seconds', time.time() - start)
+
+        if contract.tx_sink is not None:
+            for t in contract.txs:
+                contract.tx_sink.append(t)
         logging.info('-' * 20)
 
 
+class RingSink(deque):
+    """Tx sink keeping only the last ``maxlen`` emitted txs"""
+
+    def __init__(self, maxlen):
+        deque.__init__(self, maxlen=maxlen)
+
+
+class CallbackSink(object):
+    """Tx sink calling ``callback(tx)`` for every emitted tx"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def append(self, tx):
+        self.callback(tx)
+
+
+class FileSink(object):
+    """Tx sink streaming emitted txs to ``path`` as JSON lines"""
+
+    def __init__(self, path):
+        import json
+        self.dumps = json.dumps
+        self.fp = open(path, 'w')
+
+    def append(self, tx):
+        self.fp.write(self.dumps(tx, default=str) + "\n")
+
+    def close(self):
+        self.fp.close()
+
+
 class Storage(object):
 
+    # Called as on_write(key, value) before every write
+    on_write = None
+
     def __init__(self):
         self._storage = defaultdict(int)
 
+    def __getattr__(self, name):
+        # Storage restored from a bundle is read on first access
+        if name == '_storage' and '_load' in self.__dict__:
+            self._storage = self.__dict__.pop('_load')()
+            return self._storage
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        return {'_storage': self._storage}
+
     def __getitem__(self, key):
-        if _is_called_by_contract():
+        if _debugging() and _is_called_by_contract():
             logging.debug("Accessing storage '%s'" % key)
+        metrics.counters['sim_storage_reads_total'] += 1
         return self._storage[key]
 
     def __setitem__(self, key, value):
-        if _is_called_by_contract():
+        if _debugging() and _is_called_by_contract():
             logging.debug("Setting storage '%s' to '%s'" % (key, value))
+        if self.on_write is not None:
+            self.on_write(key, value)
+        metrics.counters['sim_storage_writes_total'] += 1
         self._storage[key] = value
 
     def __repr__(self):
@@ -234,12 +543,137 @@ class Storage(object):
 
 class Tx(object):
 
-    def __init__(self, sender=None, value=0, fee=0, data=[]):
+    def __init__(self, sender=None, value=0, fee=0, data=[], nonce=None):
         self.sender = sender
         self.value = value
         self.fee = fee
         self.data = data
         self.datan = len(data)
+        self.nonce = nonce
 
     def __repr__(self):
         return '<tx sender=%s value=%d fee=%d data=%s datan=%d>' % (self.sender, self.value, self.fee, self.data, self.datan)
+
+
+class Histogram(object):
+
+    BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return ``[(upper bound, count of observations <= bound)]``"""
+        total, out = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            out.append((bound, total))
+        return out
+
+
+class Metrics(object):
+    """Counters and latency histograms of the simulator.
+
+    Updates are plain dict increments. Stops are labelled by the
+    ``file:line`` of the ``stop`` call, or by the message of a ``Stop`` raised
+    directly, up to ``MAX_REASONS`` distinct ones, beyond which they count as
+    ``other``.
+    """
+
+    MAX_REASONS = 100
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.stops = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    def stop(self, reason):
+        reason = "" if reason is True else str(reason)
+        if reason not in self.stops and len(self.stops) >= self.MAX_REASONS:
+            reason = "other"
+        self.stops[reason] += 1
+
+    def snapshot(self):
+        return {'time': time.time(),
+                'counters': dict(self.counters),
+                'stops': dict(self.stops),
+                'histograms': dict((name, {'sum': h.sum, 'count': h.count, 'buckets': h.cumulative()[:-1]})
+                                   for name, h in self.histograms.items())}
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        out = []
+        for name, value in sorted(self.counters.items()):
+            out.append("# TYPE %s counter" % name)
+            out.append("%s %s" % (name, value))
+        out.append("# TYPE sim_stops_total counter")
+        for reason, value in sorted(self.stops.items()):
+            label = reason.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            out.append('sim_stops_total{reason="%s"} %d' % (label, value))
+        for name, h in sorted(self.histograms.items()):
+            out.append("# TYPE %s histogram" % name)
+            for bound, count in h.cumulative():
+                out.append('%s_bucket{le="%s"} %d' % (name, "+Inf" if bound == float('inf') else repr(bound), count))
+            out.append("%s_sum %r" % (name, h.sum))
+            out.append("%s_count %d" % (name, h.count))
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as fp:
+            fp.write(self.prometheus())
+        os.rename(tmp, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve the Prometheus text on ``http://host:port/metrics`` from a thread"""
+        import BaseHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.prometheus()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def write_json_snapshots(self, path, interval):
+        """Append a JSON snapshot to ``path`` every ``interval`` seconds from a thread"""
+        import json
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                with open(path, 'a') as fp:
+                    fp.write(json.dumps(self.snapshot(), default=str) + "\n")
+
+        thread = threading.Thread(target=loop)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+metrics = Metrics()
@@ -0,0 +1,386 @@
+"""Bytecode backend for CLL contracts.
+
+``compile_cll`` parses the translated contract with ``ast`` and flattens it
+into an ``array`` of ``(opcode, argument)`` pairs, a constant pool and a name
+table. Jump arguments are absolute code offsets resolved at compile time.
+``execute`` runs a ``Program`` on a single loop and stops the contract once it
+has spent its step budget.
+"""
+from array import array
+import ast
+import logging
+import operator
+
+from sim import Stop, array as cll_array, log, metrics, stop, translate
+
+DEFAULT_STEP_BUDGET = 100000
+
+(CONST, LOAD_LOCAL, STORE_LOCAL, LOAD_NAME, LOAD_ATTR, SUBSCR, STORE_SUBSCR,
+ BINOP, UNARYOP, COMPARE, JUMP, JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP,
+ JUMP_IF_TRUE_OR_POP, CALL, POP, DUP_TOP2, BUILD_LIST, BUILD_TUPLE, HALT) = range(20)
+
+OPNAMES = ('CONST', 'LOAD_LOCAL', 'STORE_LOCAL', 'LOAD_NAME', 'LOAD_ATTR', 'SUBSCR', 'STORE_SUBSCR',
+           'BINOP', 'UNARYOP', 'COMPARE', 'JUMP', 'JUMP_IF_FALSE', 'JUMP_IF_FALSE_OR_POP',
+           'JUMP_IF_TRUE_OR_POP', 'CALL', 'POP', 'DUP_TOP2', 'BUILD_LIST', 'BUILD_TUPLE', 'HALT')
+
+BINOPS = [
+    (ast.Add, operator.add),
+    (ast.Sub, operator.sub),
+    (ast.Mult, operator.mul),
+    (ast.Div, operator.div),
+    (ast.FloorDiv, operator.floordiv),
+    (ast.Mod, operator.mod),
+    (ast.Pow, operator.pow),
+    (ast.LShift, operator.lshift),
+    (ast.RShift, operator.rshift),
+    (ast.BitOr, operator.or_),
+    (ast.BitXor, operator.xor),
+    (ast.BitAnd, operator.and_),
+]
+
+UNARYOPS = [
+    (ast.USub, operator.neg),
+    (ast.UAdd, operator.pos),
+    (ast.Not, operator.not_),
+    (ast.Invert, operator.invert),
+]
+
+COMPAREOPS = [
+    (ast.Eq, operator.eq),
+    (ast.NotEq, operator.ne),
+    (ast.Lt, operator.lt),
+    (ast.LtE, operator.le),
+    (ast.Gt, operator.gt),
+    (ast.GtE, operator.ge),
+    (ast.Is, operator.is_),
+    (ast.IsNot, operator.is_not),
+    (ast.In, lambda a, b: a in b),
+    (ast.NotIn, lambda a, b: a not in b),
+]
+
+# Jump tables from the operator argument to its implementation
+BINOP_TABLE = [fn for _, fn in BINOPS]
+UNARYOP_TABLE = [fn for _, fn in UNARYOPS]
+COMPARE_TABLE = [fn for _, fn in COMPAREOPS]
+
+
+class Program(object):
+
+    def __init__(self, code, consts, names, nlocals):
+        self.code = code
+        self.consts = consts
+        self.names = names
+        self.nlocals = nlocals
+
+    def disassemble(self):
+        out = []
+        for pc in range(0, len(self.code), 2):
+            op, arg = self.code[pc], self.code[pc + 1]
+            out.append("%5d %-22s %d" % (pc, OPNAMES[op], arg))
+        return "\n".join(out)
+
+
+class Compiler(ast.NodeVisitor):
+
+    def __init__(self):
+        self.code = array('l')
+        self.consts = []
+        self.names = []
+        self.locals = {}
+        self.loops = []
+
+    def compile(self, tree):
+        self.collect_locals(tree)
+        for node in tree.body:
+            self.visit(node)
+        self.emit(HALT)
+        return Program(self.code, self.consts, self.names, len(self.locals))
+
+    def collect_locals(self, tree):
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                self.locals.setdefault(node.id, len(self.locals))
+
+    def emit(self, op, arg=0):
+        self.code.append(op)
+        self.code.append(arg)
+        return len(self.code) - 1
+
+    def patch(self, offset, target=None):
+        self.code[offset] = len(self.code) if target is None else target
+
+    def const(self, value):
+        for i, c in enumerate(self.consts):
+            if type(c) is type(value) and c == value:
+                return i
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def name(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+    def generic_visit(self, node):
+        raise SyntaxError("Unsupported in bytecode backend: %s at line %s" %
+                          (node.__class__.__name__, getattr(node, 'lineno', '?')))
+
+    # Statements
+
+    def visit_Expr(self, node):
+        self.visit(node.value)
+        self.emit(POP)
+
+    def visit_Pass(self, node):
+        pass
+
+    def visit_Assign(self, node):
+        if len(node.targets) != 1:
+            raise SyntaxError("Chained assignment at line %d" % node.lineno)
+        target = node.targets[0]
+        if isinstance(target, ast.Name):
+            self.visit(node.value)
+            self.emit(STORE_LOCAL, self.locals[target.id])
+        elif isinstance(target, ast.Subscript):
+            self.visit(target.value)
+            self.visit(target.slice)
+            self.visit(node.value)
+            self.emit(STORE_SUBSCR)
+        else:
+            self.generic_visit(target)
+
+    def visit_AugAssign(self, node):
+        target = node.target
+        if isinstance(target, ast.Name):
+            self.emit(LOAD_LOCAL, self.locals[target.id])
+            self.visit(node.value)
+            self.emit(BINOP, self.op_index(BINOPS, node.op))
+            self.emit(STORE_LOCAL, self.locals[target.id])
+        elif isinstance(target, ast.Subscript):
+            self.visit(target.value)
+            self.visit(target.slice)
+            self.emit(DUP_TOP2)
+            self.emit(SUBSCR)
+            self.visit(node.value)
+            self.emit(BINOP, self.op_index(BINOPS, node.op))
+            self.emit(STORE_SUBSCR)
+        else:
+            self.generic_visit(target)
+
+    def visit_If(self, node):
+        self.visit(node.test)
+        to_else = self.emit(JUMP_IF_FALSE)
+        for stmt in node.body:
+            self.visit(stmt)
+        if node.orelse:
+            to_end = self.emit(JUMP)
+            self.patch(to_else)
+            for stmt in node.orelse:
+                self.visit(stmt)
+            self.patch(to_end)
+        else:
+            self.patch(to_else)
+
+    def visit_While(self, node):
+        start = len(self.code)
+        self.visit(node.test)
+        to_end = self.emit(JUMP_IF_FALSE)
+        self.loops.append((start, []))
+        for stmt in node.body:
+            self.visit(stmt)
+        self.emit(JUMP, start)
+        _, breaks = self.loops.pop()
+        self.patch(to_end)
+        # The else branch runs when the test fails, a break skips it
+        for stmt in node.orelse:
+            self.visit(stmt)
+        for offset in breaks:
+            self.patch(offset)
+
+    def visit_Break(self, node):
+        self.loops[-1][1].append(self.emit(JUMP))
+
+    def visit_Continue(self, node):
+        self.emit(JUMP, self.loops[-1][0])
+
+    # Expressions
+
+    def visit_Num(self, node):
+        self.emit(CONST, self.const(node.n))
+
+    def visit_Str(self, node):
+        self.emit(CONST, self.const(node.s))
+
+    def visit_Name(self, node):
+        if node.id in self.locals:
+            self.emit(LOAD_LOCAL, self.locals[node.id])
+        else:
+            self.emit(LOAD_NAME, self.name(node.id))
+
+    def visit_Attribute(self, node):
+        self.visit(node.value)
+        self.emit(LOAD_ATTR, self.name(node.attr))
+
+    def visit_Subscript(self, node):
+        self.visit(node.value)
+        self.visit(node.slice)
+        self.emit(SUBSCR)
+
+    def visit_Index(self, node):
+        self.visit(node.value)
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(BINOP, self.op_index(BINOPS, node.op))
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.operand)
+        self.emit(UNARYOP, self.op_index(UNARYOPS, node.op))
+
+    def visit_BoolOp(self, node):
+        op = JUMP_IF_FALSE_OR_POP if isinstance(node.op, ast.And) else JUMP_IF_TRUE_OR_POP
+        jumps = []
+        for value in node.values[:-1]:
+            self.visit(value)
+            jumps.append(self.emit(op))
+        self.visit(node.values[-1])
+        for offset in jumps:
+            self.patch(offset)
+
+    def visit_Compare(self, node):
+        if len(node.ops) != 1:
+            raise SyntaxError("Chained comparison at line %d" % node.lineno)
+        self.visit(node.left)
+        self.visit(node.comparators[0])
+        self.emit(COMPARE, self.op_index(COMPAREOPS, node.ops[0]))
+
+    def visit_Call(self, node):
+        if node.keywords or getattr(node, 'starargs', None) or getattr(node, 'kwargs', None):
+            raise SyntaxError("Only positional arguments are supported at line %d" % node.lineno)
+        self.visit(node.func)
+        for arg in node.args:
+            self.visit(arg)
+        self.emit(CALL, len(node.args))
+
+    def visit_List(self, node):
+        for elt in node.elts:
+            self.visit(elt)
+        self.emit(BUILD_LIST, len(node.elts))
+
+    def visit_Tuple(self, node):
+        for elt in node.elts:
+            self.visit(elt)
+        self.emit(BUILD_TUPLE, len(node.elts))
+
+    def op_index(self, table, op):
+        for i, (cls, _) in enumerate(table):
+            if isinstance(op, cls):
+                return i
+        self.generic_visit(op)
+
+
+def compile_cll(script):
+    """Compile the CLL file ``script`` into a ``Program``"""
+    return Compiler().compile(ast.parse(translate(script), script))
+
+
+def execute(program, env, steps=DEFAULT_STEP_BUDGET):
+    """Run ``program`` resolving free names in ``env``.
+
+    Raises ``Stop`` when the program executes more than ``steps`` instructions.
+    """
+    code = program.code
+    consts = program.consts
+    names = program.names
+    local = [0] * program.nlocals
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    pc = 0
+
+    while True:
+        steps -= 1
+        if steps < 0:
+            raise Stop("Out of steps")
+
+        op = code[pc]
+        arg = code[pc + 1]
+        pc += 2
+
+        if op == LOAD_LOCAL:
+            push(local[arg])
+        elif op == CONST:
+            push(consts[arg])
+        elif op == LOAD_ATTR:
+            push(getattr(pop(), names[arg]))
+        elif op == SUBSCR:
+            key = pop()
+            push(pop()[key])
+        elif op == BINOP:
+            right = pop()
+            push(BINOP_TABLE[arg](pop(), right))
+        elif op == COMPARE:
+            right = pop()
+            push(COMPARE_TABLE[arg](pop(), right))
+        elif op == JUMP_IF_FALSE:
+            if not pop():
+                pc = arg
+        elif op == STORE_LOCAL:
+            local[arg] = pop()
+        elif op == LOAD_NAME:
+            push(env[names[arg]])
+        elif op == STORE_SUBSCR:
+            value = pop()
+            key = pop()
+            pop()[key] = value
+        elif op == JUMP:
+            pc = arg
+        elif op == CALL:
+            args = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            push(pop()(*args))
+        elif op == POP:
+            pop()
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if not stack[-1]:
+                pc = arg
+            else:
+                pop()
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if stack[-1]:
+                pc = arg
+            else:
+                pop()
+        elif op == UNARYOP:
+            push(UNARYOP_TABLE[arg](pop()))
+        elif op == DUP_TOP2:
+            stack.extend(stack[-2:])
+        elif op == BUILD_LIST:
+            items = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            push(items)
+        elif op == BUILD_TUPLE:
+            items = tuple(stack[len(stack) - arg:])
+            del stack[len(stack) - arg:]
+            push(items)
+        elif op == HALT:
+            return
+        else:
+            raise RuntimeError("Invalid opcode %d at %d" % (op, pc - 2))
+
+
+def run(program, tx, contract, block, constants, steps=DEFAULT_STEP_BUDGET):
+    """Execute ``program`` as the body of ``contract.run``"""
+    def mktx(recipient, amount, datan, data):
+        logging.info("Sending tx to %s of %s" % (recipient, amount))
+        metrics.counters['sim_mktx_total'] += 1
+        metrics.counters['sim_mktx_value_total'] += amount
+        contract.txs.append((recipient, amount, datan, data))
+
+    env = dict(constants)
+    env.update({'tx': tx, 'contract': contract, 'block': block,
+                'stop': stop, 'log': log, 'mktx': mktx, 'array': cll_array,
+                'min': min, 'max': max, 'int': int, 'len': len,
+                'True': True, 'False': False, 'None': None})
+    execute(program, env, steps)
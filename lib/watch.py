@@ -0,0 +1,81 @@
+"""Re-run simulations when their scripts or ``.cll`` sources change.
+
+Files are polled by modification time. A changed ``.cll`` file only drops its
+own entries from ``Contract.compiled``, so the other contracts are not
+translated again. Only the simulations whose script or loaded sources changed
+are reloaded in-process and run again.
+"""
+import logging
+import os
+import time
+import traceback
+
+from sim import Contract, Simulation, load_class
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class Watcher(object):
+
+    def __init__(self, scripts, interval=0.05):
+        self.scripts = scripts
+        self.interval = interval
+        # script -> paths it depends on, itself and the .cll sources it loaded
+        self.depends = dict((script, set([script])) for script in scripts)
+        self.mtimes = {}
+
+    def run(self, script):
+        """Reload ``script`` and run its simulation, return whether it passed"""
+        Contract.sources.clear()
+        start = time.time()
+        try:
+            load_class(script, Simulation)().run_all()
+            ok = True
+        except Exception:
+            traceback.print_exc()
+            ok = False
+        finally:
+            self.depends[script] = set([script]) | Contract.sources
+        print "%-4s %s (%.0fms)" % ("ok" if ok else "FAIL", script, (time.time() - start) * 1000)
+        return ok
+
+    def changed(self):
+        """Return the watched paths modified since the last call.
+
+        Paths not seen before, such as sources loaded for the first time by
+        the last run, start being watched without counting as changed.
+        """
+        changed = set()
+        for path in set().union(*self.depends.values()):
+            current = mtime(path)
+            if path not in self.mtimes:
+                self.mtimes[path] = current
+            elif self.mtimes[path] != current:
+                self.mtimes[path] = current
+                changed.add(path)
+        return changed
+
+    def invalidate(self, paths):
+        for key in list(Contract.compiled):
+            if (key[0] if isinstance(key, tuple) else key) in paths:
+                del Contract.compiled[key]
+
+    def loop(self):
+        for script in self.scripts:
+            self.run(script)
+        self.changed()
+        logging.warn("Watching %d files" % len(self.mtimes))
+        while True:
+            time.sleep(self.interval)
+            changed = self.changed()
+            if not changed:
+                continue
+            self.invalidate(changed)
+            for script in self.scripts:
+                if self.depends[script] & changed:
+                    self.run(script)
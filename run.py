@@ -1,44 +1,311 @@
 #!/usr/bin/env python
 
 import argparse
-import imp
-import inspect
 import logging
 import os.path
 import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'lib'))
 
-from sim import Simulation
-
-def get_subclasses(mod, cls):
-    """Yield the classes in module ``mod`` that inherit from ``cls``"""
-    for name, obj in inspect.getmembers(mod):
-        if hasattr(obj, "__bases__") and cls in obj.__bases__:
-            yield obj
+from sim import Contract, Simulation, load_class, set_constants
 
 def load_simulation_class(script):
-    sim_name = os.path.splitext(os.path.basename(script))[0]
-    sim_module = imp.load_source(sim_name, script)
+    from cache import DiscoveryIndex
 
-    sims = list(get_subclasses(sim_module, Simulation))
-    if len(sims) < 1:
-        raise RuntimeError("No Simulation found in %s" % script)
-    elif len(sims) > 1:
-        raise RuntimeError("Multiple Simulations found in %s" % script)
+    index = DiscoveryIndex()
+    simulation_class = index.load(script)
+    index.save()
+    return simulation_class
 
-    return sims[0]
+def set_backend(backend, steps):
+    Contract.backend = backend
+    Contract.step_budget = steps
 
-def main(script):
+def main(script, coverage=False, restore=None, save=None):
     logging.basicConfig(format='%(module)-12s %(levelname)-8s%(message)s',
                         level=logging.DEBUG)
 
     simulation_class = load_simulation_class(script)
+    if coverage:
+        from instrument import Coverage
+        Contract.coverage = Coverage()
+        Contract.coverage.instrument_module(sys.modules[simulation_class.__module__])
+
     simulation = simulation_class()
-    simulation.run_all()
+    if restore is not None:
+        import bundle
+        bundle.restore(simulation, restore)
+
+    try:
+        simulation.run_all()
+    finally:
+        if coverage:
+            print Contract.coverage.report()
+
+    if save is not None:
+        import bundle
+        bundle.save(simulation, save)
+
+def cached_main(script, options, force=False):
+    """Run ``main(script)`` unless the cache holds the result for unchanged sources"""
+    import time
+    import traceback
+    from cache import ResultCache, module_files
+
+    cache = ResultCache()
+    key = cache.key(script, options)
+    entry = None if force else cache.get(key)
+    if entry is not None:
+        print "%s: cached %s (%.3fs)" % (script, "ok" if entry['ok'] else "FAIL", entry['seconds'])
+        if not entry['ok']:
+            print entry['detail']
+            sys.exit(1)
+        return
+
+    Contract.sources.clear()
+    modules = set(sys.modules)
+    start = time.time()
+    try:
+        main(script)
+    except Exception:
+        sources = Contract.sources | module_files(set(sys.modules) - modules)
+        cache.put(key, sources, False, traceback.format_exc().strip().splitlines()[-1], time.time() - start)
+        raise
+    cache.put(key, Contract.sources | module_files(set(sys.modules) - modules), True, None, time.time() - start)
+
+def watch_main(scripts, interval):
+    from watch import Watcher
+
+    logging.basicConfig(format='%(module)-12s %(levelname)-8s%(message)s', level=logging.INFO)
+    try:
+        Watcher(scripts, interval).loop()
+    except KeyboardInterrupt:
+        pass
+
+def startup_main(scripts, runs, budget):
+    """Time fresh interpreters importing sim and running ``scripts``, in milliseconds"""
+    import subprocess
+    import time
+
+    lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+    commands = [("import sim", [sys.executable, '-c', 'import sys; sys.path.insert(0, %r); import sim' % lib])]
+    for script in scripts:
+        commands.append((script + " --force", [sys.executable, __file__, script, '--force']))
+        commands.append((script + " cached", [sys.executable, __file__, script]))
+
+    over = False
+    with open(os.devnull, 'w') as devnull:
+        for name, command in commands:
+            times = []
+            for _ in range(runs):
+                start = time.time()
+                subprocess.call(command, stdout=devnull, stderr=devnull)
+                times.append((time.time() - start) * 1000)
+            median = sorted(times)[len(times) // 2]
+            slow = budget is not None and median > budget
+            over = over or slow
+            print "%8.1fms median %8.1fms min  %s%s" % (median, min(times), name, "  OVER BUDGET" if slow else "")
+    sys.exit(1 if over else 0)
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics", metavar="FILE", help="write Prometheus text metrics to FILE at exit")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running")
+    parser.add_argument("--metrics-json", metavar="FILE", help="append JSON snapshots of the metrics to FILE")
+    parser.add_argument("--metrics-interval", type=float, default=10, metavar="SECONDS",
+                        help="interval between JSON snapshots")
+
+def export_metrics(args):
+    """Start the metrics exports of ``args``, return a function finishing them"""
+    import json
+    from sim import metrics
+
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+    if args.metrics_json is not None:
+        metrics.write_json_snapshots(args.metrics_json, args.metrics_interval)
+
+    def finish():
+        if args.metrics is not None:
+            metrics.write_prometheus(args.metrics)
+        if args.metrics_json is not None:
+            with open(args.metrics_json, 'a') as fp:
+                fp.write(json.dumps(metrics.snapshot(), default=str) + "\n")
+    return finish
+
+def parse_constant(s):
+    from replay import parse_value
+    name, _, value = s.partition('=')
+    return name, parse_value(value)
+
+def replay_main(contract_script, tx_file, constants, log_level, sink=None):
+    from replay import read_txs, replay
+    from sim import FileSink
+
+    logging.basicConfig(format='%(module)-12s %(levelname)-8s%(message)s',
+                        level=getattr(logging, log_level))
+
+    contract_class = load_class(contract_script, Contract)
+    contract = contract_class(**dict(constants))
+    set_constants(contract_class, dict(constants))
+    if sink is not None:
+        contract.tx_sink = FileSink(sink)
+
+    try:
+        stops = replay(Simulation(), contract, read_txs(tx_file))
+    finally:
+        if sink is not None:
+            contract.tx_sink.close()
+    for reason, count in stops.most_common():
+        print "%8d  %s" % (count, "completed" if reason is None else reason)
+
+def serve_main(address, log_level):
+    from daemon import serve
+
+    logging.basicConfig(format='%(module)-12s %(levelname)-8s%(message)s',
+                        level=getattr(logging, log_level))
+    serve(address, lambda script: load_class(script, Contract))
+
+def diff_main(names, seed, seeds, n, strict, processes):
+    import differential
+
+    logging.basicConfig(format='%(module)-12s %(levelname)-8s%(message)s', level=logging.ERROR)
+
+    results = differential.run_ports(names or sorted(differential.PORTS), range(seed, seed + seeds),
+                                     n, strict, processes)
+    for name, seed, result in results:
+        print differential.describe(name, seed, result, n)
+    sys.exit(0 if all(result is None for _, _, result in results) else 1)
+
+def parse_param(s):
+    from replay import parse_value
+    name, _, values = s.partition('=')
+    return name, [parse_value(v) for v in values.split(',')]
+
+def coordinator_main(scripts, port, bind, seed, seeds, params, diff, txs, local):
+    import subprocess
+    import cluster
+
+    logging.basicConfig(format='%(module)-12s %(levelname)-8s%(message)s', level=logging.WARNING)
+
+    grid = dict(params)
+    if diff:
+        grid['txs'] = [txs]
+    units = cluster.make_units('diff' if diff else 'simulation', scripts, range(seed, seed + seeds), grid)
+    coordinator = cluster.Coordinator((bind, port), units)
+
+    host, port = coordinator.server_address
+
+    def spawn():
+        return subprocess.Popen([sys.executable, __file__, 'worker', '%s:%d' % (host, port)])
+
+    results = coordinator.results(spawn, local)
+    for (uid, kind, script, unit_seed, point), (ok, detail) in results:
+        line = "%5d %-4s %s seed=%d" % (uid, "ok" if ok else "FAIL", script, unit_seed)
+        for name, value in sorted(point.items()):
+            line += " %s=%s" % (name, value)
+        if detail and not ok:
+            line += "\n      %s" % detail
+        print line
+    sys.exit(0 if all(ok for _, (ok, _) in results) else 1)
+
+def worker_main(address):
+    import cluster
+
+    logging.basicConfig(format='%(module)-12s %(levelname)-8s%(message)s', level=logging.ERROR)
+    host, _, port = address.rpartition(':')
+    cluster.worker((host, int(port)))
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument("script")
-    args = parser.parse_args()
-    main(args.script)
+    if sys.argv[1:2] == ['coordinator']:
+        parser = argparse.ArgumentParser(prog="run.py coordinator")
+        parser.add_argument("scripts", nargs="+", help="simulation scripts, or ports with --diff")
+        parser.add_argument("--port", type=int, default=0)
+        parser.add_argument("--bind", default="127.0.0.1")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--seeds", type=int, default=1, help="number of seeds per parameter point")
+        parser.add_argument("-p", "--param", action="append", default=[], type=parse_param,
+                            metavar="NAME=V1,V2", help="sweep module constant NAME over the values")
+        parser.add_argument("--diff", action="store_true", help="run differential units for ports")
+        parser.add_argument("-n", "--txs", type=int, default=10000, help="txs per differential unit")
+        parser.add_argument("--local", type=int, default=0, metavar="N", help="start N local workers")
+        args = parser.parse_args(sys.argv[2:])
+        coordinator_main(args.scripts, args.port, args.bind, args.seed, args.seeds, args.param,
+                         args.diff, args.txs, args.local)
+    elif sys.argv[1:2] == ['worker']:
+        parser = argparse.ArgumentParser(prog="run.py worker")
+        parser.add_argument("address", metavar="HOST:PORT")
+        args = parser.parse_args(sys.argv[2:])
+        worker_main(args.address)
+    elif sys.argv[1:2] == ['startup']:
+        parser = argparse.ArgumentParser(prog="run.py startup")
+        parser.add_argument("scripts", nargs="*", default=["examples/namecoin.py"])
+        parser.add_argument("-n", "--runs", type=int, default=20)
+        parser.add_argument("--budget", type=float, metavar="MS", help="fail if a median exceeds MS milliseconds")
+        args = parser.parse_args(sys.argv[2:])
+        startup_main(args.scripts, args.runs, args.budget)
+    elif sys.argv[1:2] == ['diff']:
+        parser = argparse.ArgumentParser(prog="run.py diff")
+        parser.add_argument("ports", nargs="*", help="ports to compare, all by default")
+        parser.add_argument("-n", "--txs", type=int, default=10000, help="txs per seed")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--seeds", type=int, default=1, help="number of seeds per port")
+        parser.add_argument("--strict", action="store_true", help="compare stop messages too")
+        parser.add_argument("-j", "--processes", type=int)
+        args = parser.parse_args(sys.argv[2:])
+        diff_main(args.ports, args.seed, args.seeds, args.txs, args.strict, args.processes)
+    elif sys.argv[1:2] == ['serve']:
+        parser = argparse.ArgumentParser(prog="run.py serve")
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument("--unix", metavar="PATH", help="listen on a Unix socket")
+        group.add_argument("--port", type=int, help="listen on localhost:PORT")
+        parser.add_argument("--log-level", default="WARNING")
+        args = parser.parse_args(sys.argv[2:])
+        serve_main(args.unix or ('127.0.0.1', args.port), args.log_level)
+    elif sys.argv[1:2] == ['replay']:
+        parser = argparse.ArgumentParser(prog="run.py replay")
+        parser.add_argument("contract_script")
+        parser.add_argument("tx_file", help=".jsonl or .csv file of transactions")
+        parser.add_argument("-c", "--constant", action="append", default=[], type=parse_constant,
+                            metavar="NAME=VALUE", help="contract constant")
+        parser.add_argument("--log-level", default="WARNING")
+        parser.add_argument("--sink", metavar="FILE", help="write emitted txs to FILE as JSON lines")
+        add_metrics_arguments(parser)
+        args = parser.parse_args(sys.argv[2:])
+        finish = export_metrics(args)
+        try:
+            replay_main(args.contract_script, args.tx_file, args.constant, args.log_level, args.sink)
+        finally:
+            finish()
+    else:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("scripts", nargs="+", metavar="script", help="simulation script, several with --watch")
+        parser.add_argument("--backend", choices=["python", "bytecode"], default="python",
+                            help="how contracts loaded from .cll files are run")
+        parser.add_argument("--steps", type=int, help="step budget per tx for the bytecode backend")
+        parser.add_argument("--coverage", action="store_true", help="report line and branch coverage of the contracts")
+        parser.add_argument("--restore", metavar="BUNDLE", help="start from the state saved in BUNDLE")
+        parser.add_argument("--save", metavar="BUNDLE", help="save the final state to BUNDLE")
+        parser.add_argument("--force", action="store_true",
+                            help="run even if the script, its .cll sources and the simulator are unchanged")
+        parser.add_argument("--watch", action="store_true",
+                            help="re-run the simulations whenever they or their .cll sources change")
+        parser.add_argument("--interval", type=float, default=0.05, metavar="SECONDS",
+                            help="how often --watch polls the files")
+        add_metrics_arguments(parser)
+        args = parser.parse_args()
+        if len(args.scripts) > 1 and not args.watch:
+            parser.error("several scripts need --watch")
+        args.script = args.scripts[0]
+        set_backend(args.backend, args.steps)
+        if args.watch:
+            watch_main(args.scripts, args.interval)
+            sys.exit(0)
+        finish = export_metrics(args)
+        try:
+            if not (args.coverage or args.restore or args.save):
+                cached_main(args.script, [('backend', args.backend), ('steps', args.steps)], args.force)
+            else:
+                main(args.script, args.coverage, args.restore, args.save)
+        finally:
+            finish()